@@ -1 +1,6 @@
-from .controller import Controller
+def __getattr__(name):
+    # Imported on first use, so tools and submodules don't pay for the controller's imports
+    if name == 'Controller':
+        from .controller import Controller
+        return Controller
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
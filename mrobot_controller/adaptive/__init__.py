@@ -0,0 +1 @@
+from .adaptive_quality import AdaptiveQualityController
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+
+class AdaptiveQualityController:
+    """
+    Moves the video pipeline between quality rungs, according to the measured link conditions.
+
+    Every interval, the send counters of the controlling client are sampled. When frames are dropped
+    or wait too long to be sent, the pipeline steps down a rung. After the link stayed healthy for
+    a few consecutive intervals, it steps back up. Rung 0 is the highest quality.
+
+    The frame rate and scale of the configuration, or of the last video_configure command, are limits: a rung only
+    ever lowers them, and the stricter of the two values is applied.
+    """
+    def __init__(self, video_streamer, websocket_server, config: dict, limits: dict):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.video_streamer = video_streamer
+        self.websocket_server = websocket_server
+
+        self.rungs = config['rungs']
+        self.interval = config['interval']
+        self.max_delay = config['max-delay']
+        self.max_drop_ratio = config['max-drop-ratio']
+        self.upgrade_intervals = config['upgrade-intervals']
+
+        # Frame rate (0 for the source rate) and scale
+        self.limits = {'framerate': limits['framerate'], 'scale': limits['scale']}
+        self.rung = 0
+        self.healthy_intervals = 0
+        self.throughput = 0.0
+        self.previous_stats = {}
+
+    def limit(self, quality: dict, limits: dict) -> dict:
+        """The rung `quality`, with its frame rate and scale lowered to `limits`"""
+        framerates = [framerate for framerate in (quality.get('framerate', 0), limits['framerate']) if framerate > 0]
+        return {**quality,
+                'framerate': min(framerates) if framerates else 0,
+                'scale': min(quality.get('scale', 1.0), limits['scale'])}
+
+    def apply(self, rung: int):
+        self.rung = rung
+        self.healthy_intervals = 0
+        self.logger.info(f'Switching to quality rung {rung}: {self.rungs[rung]}')
+        self.video_streamer.set_quality(self.limit(self.rungs[rung], self.limits))
+
+    def configure(self, output: dict):
+        """Apply an output configuration, whose frame rate and scale become the limits of the rungs"""
+        limits = {**self.limits, **{key: output[key] for key in self.limits if key in output}}
+        self.video_streamer.set_quality({**output, **self.limit(self.rungs[self.rung], limits)})
+        self.limits = limits
+
+    def update(self, stats: dict):
+        if not stats:
+            self.previous_stats = {}
+            return
+
+        previous = self.previous_stats
+        self.previous_stats = stats
+        if not previous or stats['frames_sent'] < previous.get('frames_sent', 0):
+            return
+
+        sent = stats['frames_sent'] - previous['frames_sent']
+        dropped = stats['frames_dropped'] - previous['frames_dropped']
+        sent_bytes = stats['bytes_sent'] - previous['bytes_sent']
+        send_time = stats['send_time'] - previous['send_time']
+        if sent + dropped == 0:
+            return
+
+        # Throughput of the link while sending, not diluted by idle time between frames
+        if send_time > 0:
+            self.throughput = sent_bytes / send_time
+        drop_ratio = dropped / (sent + dropped)
+        congested = drop_ratio > self.max_drop_ratio or stats['frame_delay'] > self.max_delay
+
+        if congested:
+            self.healthy_intervals = 0
+            self.logger.debug(f'Link congested: drop ratio {drop_ratio:.2f}, delay {stats["frame_delay"]:.3f}s')
+            if self.rung < len(self.rungs) - 1:
+                self.apply(self.rung + 1)
+            return
+
+        self.healthy_intervals += 1
+        if self.rung > 0 and self.healthy_intervals >= self.upgrade_intervals:
+            self.apply(self.rung - 1)
+
+    def get_stats(self) -> dict:
+        return {
+            'rung': self.rung,
+            'quality': self.rungs[self.rung],
+            'throughput': self.throughput
+        }
+
+    async def run(self):
+        self.apply(self.rung)
+        while True:
+            await asyncio.sleep(self.interval)
+            self.update(self.websocket_server.get_controller_stats())
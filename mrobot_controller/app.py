@@ -4,30 +4,33 @@ import asyncio
 from . import Controller
 from .app_config import AppConfig
 
-logging.basicConfig(
-        level=logging.DEBUG,
-        format='[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s',
-        datefmt='%d-%m-%Y %H:%M:%S'
-        )
-
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Video Streaming Application")
     parser.add_argument('config', type=str, help='Path to configuration JSON file')
+    parser.add_argument('--log-level', type=str, default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Initial log level (can be changed at runtime with the log_level command)')
     return parser.parse_args()
 
 
 def main():
+    # Parse command-line arguments
+    args = parse_arguments()
+
+    logging.basicConfig(
+            level=args.log_level,
+            format='[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s',
+            datefmt='%d-%m-%Y %H:%M:%S'
+            )
     logger = logging.getLogger('Main')
 
     logger.info('mRobot Controller')
-    # Parse command-line arguments
-    args = parse_arguments()
 
     # Load configuration from JSON file
     config = AppConfig(args.config)
 
-    controller = Controller(config.get_app_server_config()['port'], config.get_video_config())
+    controller = Controller(config)
     try:
         # Initialize and start the VideoStreamer with the configuration
         logger.info("Starting controller...")
@@ -3,7 +3,7 @@ import logging
 
 
 class AppConfig:
-    def __init__(self, config_file: str):
+    def __init__(self, config_file: str | None):
         self.logger = logging.getLogger(self.__class__.__name__)
 
         self.config = {
@@ -11,14 +11,90 @@ class AppConfig:
                 'device': "/dev/video0",
                 'width': 640,
                 'height': 480,
-                'test': False
+                'test': False,
+                'mode': 'png',
+                'transport': 'base64',
+                'jpeg-quality': 85,
+                'workers': 0,
+                'executor': 'thread',
+                'max-in-flight': 4,
+                'framerate': 0,
+                'scale': 1.0,
+                'roi': None,
+                'keyframe-interval': 30
             },
             'app-server': {
-                'port': 8765
+                'port': 8765,
+                'frame-queue-size': 1,
+                'max-viewers': 0,
+                'metrics-port': 8766,
+                'compression': 'control',
+                'max-message-size': 65536,
+                'max-queue': 16,
+                'write-limit': 32768,
+                'tcp-nodelay': True,
+                'send-buffer-size': 0,
+                'receive-buffer-size': 0
+            },
+            'motors': {
+                'backend': 'simulated',
+                'rate': 50,
+                'deadman-timeout': 0.5
+            },
+            'recording': {
+                'enabled': False,
+                'autostart': False,
+                'directory': '/var/lib/mrobot/recordings',
+                'dump-directory': '/var/lib/mrobot/dumps',
+                'segment-duration': 10,
+                'max-files': 30,
+                'queue-time': 2.0,
+                'write-buffer-size': 1048576
+            },
+            'rtp': {
+                'enabled': False,
+                'port': 7788,
+                'mtu': 1200,
+                'max-destinations': 4
+            },
+            'gating': {
+                'enabled': False,
+                'threshold': 0.02,
+                'size-threshold': 0.05,
+                'heartbeat': 5.0,
+                'settle': 1.0,
+                'downsample': 8
+            },
+            'shared-memory': {
+                'enabled': False,
+                'name': 'mrobot-frames',
+                'slots': 4
+            },
+            'supervisor': {
+                'enabled': True,
+                'stall-timeout': 2.0,
+                'backoff-initial': 0.1,
+                'backoff-max': 10.0,
+                'stable-time': 30.0
+            },
+            'adaptive': {
+                'enabled': False,
+                'interval': 1.0,
+                'max-delay': 0.25,
+                'max-drop-ratio': 0.1,
+                'upgrade-intervals': 5,
+                'rungs': [
+                    {'bitrate': 2000, 'scale': 1.0, 'framerate': 30, 'jpeg-quality': 85},
+                    {'bitrate': 1200, 'scale': 0.75, 'framerate': 25, 'jpeg-quality': 75},
+                    {'bitrate': 700, 'scale': 0.5, 'framerate': 20, 'jpeg-quality': 65},
+                    {'bitrate': 400, 'scale': 0.5, 'framerate': 15, 'jpeg-quality': 50},
+                    {'bitrate': 200, 'scale': 0.25, 'framerate': 10, 'jpeg-quality': 40}
+                ]
             }
         }
 
-        self.load_config(config_file)
+        if config_file is not None:
+            self.load_config(config_file)
 
     def load_config(self, config_file):
         try:
@@ -27,13 +103,62 @@ class AppConfig:
 
                 video_config = config_data.get("video", {})
                 server_config = config_data.get("app-server", {})
+                motors_config = config_data.get("motors", {})
+                adaptive_config = config_data.get("adaptive", {})
+                recording_config = config_data.get("recording", {})
+                rtp_config = config_data.get("rtp", {})
+                gating_config = config_data.get("gating", {})
+                shared_memory_config = config_data.get("shared-memory", {})
+                supervisor_config = config_data.get("supervisor", {})
 
                 self.config['video']['device'] = video_config.get("device", self.config['video']['device'])
                 self.config['video']['width'] = video_config.get("width", self.config['video']['width'])
                 self.config['video']['height'] = video_config.get("height", self.config['video']['height'])
                 self.config['video']['test'] = video_config.get("test", self.config['video']['test'])
+                self.config['video']['mode'] = video_config.get("mode", self.config['video']['mode'])
+                self.config['video']['transport'] = video_config.get("transport", self.config['video']['transport'])
+                self.config['video']['jpeg-quality'] = video_config.get("jpeg-quality", self.config['video']['jpeg-quality'])
+                self.config['video']['workers'] = video_config.get("workers", self.config['video']['workers'])
+                self.config['video']['executor'] = video_config.get("executor", self.config['video']['executor'])
+                self.config['video']['max-in-flight'] = video_config.get("max-in-flight", self.config['video']['max-in-flight'])
+                self.config['video']['framerate'] = video_config.get("framerate", self.config['video']['framerate'])
+                self.config['video']['scale'] = video_config.get("scale", self.config['video']['scale'])
+                self.config['video']['roi'] = video_config.get("roi", self.config['video']['roi'])
+                self.config['video']['keyframe-interval'] = video_config.get("keyframe-interval", self.config['video']['keyframe-interval'])
 
                 self.config['app-server']['port'] = server_config.get("port", self.config['app-server']['port'])
+                self.config['app-server']['frame-queue-size'] = server_config.get("frame-queue-size", self.config['app-server']['frame-queue-size'])
+                self.config['app-server']['max-viewers'] = server_config.get("max-viewers", self.config['app-server']['max-viewers'])
+                self.config['app-server']['metrics-port'] = server_config.get("metrics-port", self.config['app-server']['metrics-port'])
+                self.config['app-server']['compression'] = server_config.get("compression", self.config['app-server']['compression'])
+                self.config['app-server']['max-message-size'] = server_config.get("max-message-size", self.config['app-server']['max-message-size'])
+                self.config['app-server']['max-queue'] = server_config.get("max-queue", self.config['app-server']['max-queue'])
+                self.config['app-server']['write-limit'] = server_config.get("write-limit", self.config['app-server']['write-limit'])
+                self.config['app-server']['tcp-nodelay'] = server_config.get("tcp-nodelay", self.config['app-server']['tcp-nodelay'])
+                self.config['app-server']['send-buffer-size'] = server_config.get("send-buffer-size", self.config['app-server']['send-buffer-size'])
+                self.config['app-server']['receive-buffer-size'] = server_config.get("receive-buffer-size", self.config['app-server']['receive-buffer-size'])
+
+                self.config['motors']['backend'] = motors_config.get("backend", self.config['motors']['backend'])
+                self.config['motors']['rate'] = motors_config.get("rate", self.config['motors']['rate'])
+                self.config['motors']['deadman-timeout'] = motors_config.get("deadman-timeout", self.config['motors']['deadman-timeout'])
+
+                for key in self.config['adaptive']:
+                    self.config['adaptive'][key] = adaptive_config.get(key, self.config['adaptive'][key])
+
+                for key in self.config['recording']:
+                    self.config['recording'][key] = recording_config.get(key, self.config['recording'][key])
+
+                for key in self.config['rtp']:
+                    self.config['rtp'][key] = rtp_config.get(key, self.config['rtp'][key])
+
+                for key in self.config['gating']:
+                    self.config['gating'][key] = gating_config.get(key, self.config['gating'][key])
+
+                for key in self.config['shared-memory']:
+                    self.config['shared-memory'][key] = shared_memory_config.get(key, self.config['shared-memory'][key])
+
+                for key in self.config['supervisor']:
+                    self.config['supervisor'][key] = supervisor_config.get(key, self.config['supervisor'][key])
 
                 self.log_values()
 
@@ -50,6 +175,27 @@ class AppConfig:
     def get_app_server_config(self):
         return self.config['app-server']
 
+    def get_motors_config(self):
+        return self.config['motors']
+
+    def get_adaptive_config(self):
+        return self.config['adaptive']
+
+    def get_recording_config(self):
+        return self.config['recording']
+
+    def get_rtp_config(self):
+        return self.config['rtp']
+
+    def get_gating_config(self):
+        return self.config['gating']
+
+    def get_shared_memory_config(self):
+        return self.config['shared-memory']
+
+    def get_supervisor_config(self):
+        return self.config['supervisor']
+
     def log_values(self):
         self.logger.info('Using configuration: ')
         for line in str(self).split('\n'):
@@ -61,6 +207,50 @@ class AppConfig:
                 f'    Width:  {self.config['video']['width']}\n'
                 f'    Height: {self.config['video']['height']}\n'
                 f'    Test: {self.config['video']['test']}\n'
+                f'    Mode: {self.config['video']['mode']}\n'
+                f'    Transport: {self.config['video']['transport']}\n'
+                f'    JPEG quality: {self.config['video']['jpeg-quality']}\n'
+                f'    Encoding workers: {self.config['video']['workers']} ({self.config['video']['executor']}, '
+                f'max {self.config['video']['max-in-flight']} in flight)\n'
+                f'    Output: {self.config['video']['framerate'] or 'source'} fps, '
+                f'scale {self.config['video']['scale']}, ROI {self.config['video']['roi'] or 'full frame'}\n'
+                f'    Keyframe interval: {self.config['video']['keyframe-interval']} frames\n'
                 f'Server:\n'
-                f'    Port: {self.config['app-server']['port']}')
+                f'    Port: {self.config['app-server']['port']}\n'
+                f'    Frame queue size: {self.config['app-server']['frame-queue-size']}\n'
+                f'    Max viewers: {self.config['app-server']['max-viewers']}\n'
+                f'    Metrics port: {self.config['app-server']['metrics-port']}\n'
+                f'    Compression: {self.config['app-server']['compression']}\n'
+                f'    Max message size: {self.config['app-server']['max-message-size']} bytes '
+                f'(queue {self.config['app-server']['max-queue']} messages)\n'
+                f'    Write limit: {self.config['app-server']['write-limit']} bytes\n'
+                f'    TCP_NODELAY: {self.config['app-server']['tcp-nodelay']}, socket buffers: '
+                f'send {self.config['app-server']['send-buffer-size'] or 'default'}, '
+                f'receive {self.config['app-server']['receive-buffer-size'] or 'default'}\n'
+                f'Motors:\n'
+                f'    Backend: {self.config['motors']['backend']}\n'
+                f'    Rate: {self.config['motors']['rate']} Hz\n'
+                f'    Deadman timeout: {self.config['motors']['deadman-timeout']}s\n'
+                f'Recording:\n'
+                f'    Enabled: {self.config['recording']['enabled']} '
+                f'(autostart: {self.config['recording']['autostart']})\n'
+                f'    Directory: {self.config['recording']['directory']}\n'
+                f'    Ring: {self.config['recording']['max-files']} x {self.config['recording']['segment-duration']}s\n'
+                f'RTP:\n'
+                f'    Enabled: {self.config['rtp']['enabled']} (default port {self.config['rtp']['port']}, '
+                f'MTU {self.config['rtp']['mtu']}, max {self.config['rtp']['max-destinations']} destinations)\n'
+                f'Change gating:\n'
+                f'    Enabled: {self.config['gating']['enabled']} (threshold {self.config['gating']['threshold']}, '
+                f'size threshold {self.config['gating']['size-threshold']}, '
+                f'heartbeat {self.config['gating']['heartbeat']}s)\n'
+                f'Shared memory frames:\n'
+                f'    Enabled: {self.config['shared-memory']['enabled']} '
+                f'({self.config['shared-memory']['name']}, {self.config['shared-memory']['slots']} slots)\n'
+                f'Pipeline supervisor:\n'
+                f'    Enabled: {self.config['supervisor']['enabled']} '
+                f'(stall timeout {self.config['supervisor']['stall-timeout']}s, '
+                f'backoff {self.config['supervisor']['backoff-initial']}s to {self.config['supervisor']['backoff-max']}s)\n'
+                f'Adaptive quality:\n'
+                f'    Enabled: {self.config['adaptive']['enabled']}\n'
+                f'    Rungs: {len(self.config['adaptive']['rungs'])}')
 
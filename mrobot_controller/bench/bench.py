@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import resource
+import time
+import msgpack
+import websockets
+from ..app_config import AppConfig
+from ..controller import Controller
+from ..metrics import RollingHistogram
+from ..serdes import encode_compact, VIDEO_TRANSPORTS, PROTOCOL_COMPACT, COMPACT_MARKER, COMPACT_MOVE, \
+    COMPACT_SPEED_SCALE
+from ..video_streamer import VIDEO_MODES
+
+BINARY_VIDEO_MAGIC = b'MV'
+
+
+def get_rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak RSS, where the current one isn't available
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class BenchClient:
+    """Local websocket client, receiving video while sending move commands at a fixed rate"""
+    def __init__(self, port: int, transport: str, command_rate: float, compact: bool):
+        self.url = f'ws://127.0.0.1:{port}'
+        self.transport = transport
+        self.command_rate = command_rate
+        self.compact = compact
+
+        self.websocket = None
+        self.video_ready = asyncio.Event()
+        self.responses = {}
+        self.move_sent = collections.deque()
+        self.rtt = RollingHistogram(100_000)
+        self.frames = 0
+        self.frame_bytes = 0
+
+    async def command(self, command: str, parameters: dict):
+        response = asyncio.get_running_loop().create_future()
+        self.responses[command] = response
+        await self.websocket.send(msgpack.packb({'command': command, 'parameters': parameters}))
+        return await asyncio.wait_for(response, 10)
+
+    def on_message(self, message: bytes):
+        if message[:2] == BINARY_VIDEO_MAGIC:
+            self.on_frame(message)
+            return
+        if message[0] == COMPACT_MARKER:
+            self.on_move_response()
+            return
+
+        deserialized = msgpack.unpackb(message)
+        if deserialized.get('event', '').startswith('video_'):
+            self.on_frame(message)
+        elif deserialized.get('event') == 'ready' or deserialized.get('video_ready'):
+            self.video_ready.set()
+        elif deserialized.get('command') == 'move':
+            self.on_move_response()
+        elif deserialized.get('command') in self.responses:
+            self.responses.pop(deserialized['command']).set_result(deserialized)
+
+    def on_frame(self, message: bytes):
+        self.frames += 1
+        self.frame_bytes += len(message)
+
+    def on_move_response(self):
+        if self.move_sent:
+            self.rtt.record((time.perf_counter() - self.move_sent.popleft()) * 1000)
+
+    async def receiver(self):
+        async for message in self.websocket:
+            self.on_message(message)
+
+    async def commander(self):
+        period = 1.0 / self.command_rate
+        speed = int(0.5 * COMPACT_SPEED_SCALE)
+        compact_move = encode_compact(COMPACT_MOVE, speed, speed, ack=True)
+        move = msgpack.packb({'command': 'move', 'parameters': {'left': 0.5, 'right': 0.5}})
+        while True:
+            self.move_sent.append(time.perf_counter())
+            await self.websocket.send(compact_move if self.compact else move)
+            await asyncio.sleep(period)
+
+    async def run(self, duration: float, rss_samples: list) -> dict:
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        receiver = asyncio.create_task(self.receiver())
+        try:
+            await self.command('video_transport', {'format': self.transport})
+            if self.compact:
+                await self.command('protocol', {'version': PROTOCOL_COMPACT})
+            # The pipeline is built in the background, after the server started
+            await asyncio.wait_for(self.video_ready.wait(), 30)
+            await self.command('video_start', {})
+
+            commander = asyncio.create_task(self.commander())
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                await asyncio.sleep(1)
+                rss_samples.append(round(get_rss_mb(), 1))
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            frames, frame_bytes = self.frames, self.frame_bytes
+            commander.cancel()
+
+            stats = (await self.command('stats', {}))['response']
+            await self.command('video_stop', {})
+        finally:
+            await self.websocket.close()
+            receiver.cancel()
+
+        return {
+            'fps': frames / elapsed,
+            'bytes_per_frame': frame_bytes / frames if frames else None,
+            'cpu_ms_per_frame': cpu * 1000 / frames if frames else None,
+            'encode_ms': stats['latency']['pull_to_encoded'],
+            'capture_to_sent_ms': stats['latency']['capture_to_sent'],
+            'command_rtt_ms': self.rtt.percentiles(),
+            'frames_dropped': sum(client['frames_dropped'] for client in stats['clients'])
+        }
+
+
+async def bench_run(config: AppConfig, mode: str, transport: str, args) -> dict:
+    config.get_video_config().update(test=True, mode=mode, width=args.width, height=args.height)
+    config.get_app_server_config().update({'port': args.port, 'metrics-port': 0})
+    config.get_adaptive_config()['enabled'] = False
+    config.get_motors_config()['backend'] = 'simulated'
+    config.get_recording_config()['enabled'] = False
+    config.get_rtp_config()['enabled'] = False
+    config.get_shared_memory_config()['enabled'] = False
+
+    controller = Controller(config)
+    controller_task = asyncio.create_task(controller.run())
+    try:
+        # Let the server start listening
+        await asyncio.sleep(1)
+        rss_samples = []
+        result = await BenchClient(args.port, transport, args.command_rate, args.compact).run(args.duration,
+                                                                                             rss_samples)
+    finally:
+        controller.stop()
+        controller_task.cancel()
+        try:
+            await controller_task
+        except asyncio.CancelledError:
+            pass
+
+    return {'mode': mode, 'transport': transport, **result, 'rss_mb': rss_samples}
+
+
+async def bench(args) -> dict:
+    config = AppConfig(args.config)
+    runs = []
+    for mode in args.modes:
+        for transport in args.transports:
+            logging.getLogger('Bench').info(f'Running {mode} / {transport}')
+            runs.append(await bench_run(config, mode, transport, args))
+    return {
+        'width': args.width,
+        'height': args.height,
+        'duration': args.duration,
+        'command_rate': args.command_rate,
+        'compact': args.compact,
+        'runs': runs
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='mRobot controller benchmark, using the videotestsrc test source')
+    parser.add_argument('--config', type=str, default=None, help='Base configuration JSON file')
+    parser.add_argument('--modes', nargs='+', choices=VIDEO_MODES, default=list(VIDEO_MODES))
+    parser.add_argument('--transports', nargs='+', choices=VIDEO_TRANSPORTS, default=list(VIDEO_TRANSPORTS))
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per run')
+    parser.add_argument('--command-rate', type=float, default=50, help='move commands per second')
+    parser.add_argument('--compact', action='store_true', help='Send move commands with the compact protocol')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON results to a file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.WARNING,
+                        format='[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s',
+                        datefmt='%d-%m-%Y %H:%M:%S')
+    logging.getLogger('Bench').setLevel(logging.INFO)
+
+    results = asyncio.run(bench(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+from .change_gate import ChangeGate
@@ -0,0 +1,148 @@
+import logging
+import time
+
+
+class ChangeGate:
+    """
+    Skips frames of a static scene, with a heartbeat frame every `heartbeat` seconds.
+
+    Each frame is compared against the last frame sent, with a metric cheap enough for the streaming thread:
+    - `png` mode: mean absolute difference of a downsampled luma plane, as a fraction of the full range
+    - `jpeg` mode: relative change in the encoded frame size
+    - `h264` mode: size of a delta frame, relative to the last keyframe
+
+    H.264 delta frames depend on the frames before them, so once frames were skipped, sending resumes only
+    on a keyframe: a change requests one from the encoder, and frames are skipped until it arrives.
+    A scene is only considered static after `settle` seconds without a change.
+    """
+    def __init__(self, mode: str, config: dict, request_keyframe=None, metrics=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.mode = mode
+        self.threshold = config['threshold']
+        self.size_threshold = config['size-threshold']
+        self.heartbeat = config['heartbeat']
+        self.settle = config['settle']
+        self.downsample = config['downsample']
+        self.request_keyframe = request_keyframe
+
+        self.reference = None
+        self.last_sent = 0.0
+        self.last_change = 0.0
+        self.keyframe_size = 0
+        self.static = False
+        # H.264 only: skipping until the keyframe requested on a change arrives
+        self.resuming = False
+        self.last_metric = None
+
+        self.frames_passed = 0
+        self.frames_skipped = 0
+        self.frames_heartbeat = 0
+        self.passed_counter = None
+        self.skipped_counter = None
+        if metrics is not None:
+            self.passed_counter = metrics.counter('gate_frames_passed_total', 'Frames passed by the change gate')
+            self.skipped_counter = metrics.counter('gate_frames_skipped_total',
+                                                   'Frames of a static scene skipped by the change gate')
+
+        if mode == 'png':
+            # Only needed for the luma metric, and slow to import
+            from .luma import downsampled_luma, luma_difference
+            self.downsampled_luma = downsampled_luma
+            self.luma_difference = luma_difference
+
+    def should_send(self, frame) -> bool:
+        now = time.monotonic()
+        if self.mode == 'h264':
+            send = self.gate_h264(frame, now)
+        else:
+            send = self.gate_independent(frame, now)
+
+        if send:
+            self.last_sent = now
+            self.frames_passed += 1
+            if self.passed_counter is not None:
+                self.passed_counter.inc()
+        else:
+            self.frames_skipped += 1
+            if self.skipped_counter is not None:
+                self.skipped_counter.inc()
+        return send
+
+    def heartbeat_due(self, now: float) -> bool:
+        if now - self.last_sent >= self.heartbeat:
+            self.frames_heartbeat += 1
+            return True
+        return False
+
+    def gate_independent(self, frame, now: float) -> bool:
+        """Every frame can be decoded on its own, so any frame can be skipped"""
+        if self.reference is None:
+            # The first frame, or the first after a refresh, starts the settle period like a change
+            self.last_change = now
+        if self.mode == 'png':
+            signal = self.downsampled_luma(frame.data, frame.width, frame.height, frame.stride, self.downsample)
+            changed = self.reference is None or signal.shape != self.reference.shape or \
+                self.changed(self.luma_difference(signal, self.reference), self.threshold)
+        else:
+            signal = frame.size
+            changed = self.reference is None or \
+                self.changed(abs(signal - self.reference) / max(self.reference, 1), self.size_threshold)
+
+        self.static = not changed and now - self.last_change >= self.settle
+        if not self.static or self.heartbeat_due(now):
+            self.reference = signal
+            return True
+        return False
+
+    def gate_h264(self, frame, now: float) -> bool:
+        if self.keyframe_size == 0:
+            # No reference yet, so the settle period starts with the first frames
+            self.last_change = now
+        if frame.keyframe:
+            self.keyframe_size = frame.size
+            if self.resuming:
+                self.resuming = False
+                self.static = False
+                self.last_change = now
+                return True
+            return not self.static or self.heartbeat_due(now)
+
+        if self.resuming:
+            return False
+        changed = self.keyframe_size == 0 or self.changed(frame.size / self.keyframe_size, self.size_threshold)
+        if not self.static:
+            if not changed and now - self.last_change >= self.settle:
+                self.logger.info('Scene is static, skipping frames')
+                self.static = True
+                return False
+            return True
+
+        if changed:
+            # The decoder is missing the skipped frames, so sending resumes on a fresh keyframe
+            self.logger.info('Scene changed, resuming on the next keyframe')
+            self.resuming = True
+            if self.request_keyframe is not None:
+                self.request_keyframe()
+        return False
+
+    def refresh(self):
+        """Send the next frame (the next keyframe in H.264 mode), e.g. for a newly connected client"""
+        self.reference = None
+        if self.static:
+            self.resuming = True
+
+    def changed(self, metric: float, threshold: float) -> bool:
+        self.last_metric = metric
+        if metric > threshold:
+            self.last_change = time.monotonic()
+            return True
+        return False
+
+    def get_stats(self) -> dict:
+        return {
+            'frames_passed': self.frames_passed,
+            'frames_skipped': self.frames_skipped,
+            'heartbeats': self.frames_heartbeat,
+            'static': self.static,
+            'last_metric': self.last_metric
+        }
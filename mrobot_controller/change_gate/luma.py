@@ -0,0 +1,15 @@
+import numpy as np
+
+
+def downsampled_luma(data, width: int, height: int, stride: int, step: int) -> np.ndarray:
+    """Luma of every `step`th pixel of every `step`th row of an RGB frame, without copying the frame"""
+    rows = np.frombuffer(data, dtype=np.uint8, count=stride * height).reshape(height, stride)
+    pixels = rows[::step, :width * 3].reshape(-1, width, 3)[:, ::step]
+    # BT.601 weights in fixed point; only the sampled pixels are converted
+    return (pixels[..., 0] * np.uint16(77) + pixels[..., 1] * np.uint16(150)
+            + pixels[..., 2] * np.uint16(29)) >> 8
+
+
+def luma_difference(luma: np.ndarray, reference: np.ndarray) -> float:
+    """Mean absolute difference, as a fraction of the full luma range"""
+    return float(np.abs(luma.astype(np.int16) - reference.astype(np.int16)).mean()) / 255
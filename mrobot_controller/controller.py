@@ -1,12 +1,23 @@
 import asyncio
-import base64
 import logging
-import io
-from PIL import Image
-from .websocket import WebSocketServer, WebSocketMessageHandler
-from .serdes import deserialize, DeserializationError, serialize
-from .video_streamer import VideoStreamer, VideoFrameHandler
+import time
+from .app_config import AppConfig
+from .websocket import WebSocketServer, WebSocketMessageHandler, ClientSession, COMPRESSION_POLICIES
+from .serdes import deserialize, DeserializationError, serialize, serialize_video_event, VIDEO_TRANSPORTS, \
+    VIDEO_TRANSPORT_COPIES, is_compact, decode_compact, encode_compact_response, CompactDecodingError, \
+    PROTOCOL_VERSIONS, PROTOCOL_MSGPACK, PROTOCOL_COMPACT, COMPACT_MOVE, COMPACT_VIDEO_START, COMPACT_VIDEO_STOP, \
+    COMPACT_FLAG_ACK, COMPACT_SPEED_SCALE
+from .video_streamer import VideoFrameHandler, VideoFrame, extract_parameter_sets, dump_segments
 from .dns_sd import ServicePublisher, get_all_ips
+from .adaptive import AdaptiveQualityController
+from .metrics import LatencyStats, MetricsRegistry, MetricsServer, StartupTimer
+from .frame_processor import FrameProcessor, encode_png
+from .motors import MotorController, MOTOR_BACKENDS
+from .change_gate import ChangeGate
+from .frame_ring import FrameRingPublisher
+from .loop_handoff import LoopHandoff
+from .supervisor import PipelineSupervisor
+from .log_utils import RateLimitedLogger
 
 
 class ControllerException(Exception):
@@ -14,90 +25,631 @@ class ControllerException(Exception):
 
 
 class Controller(WebSocketMessageHandler, VideoFrameHandler):
-    def __init__(self, port: int, video_config: dict):
+    def __init__(self, config: AppConfig):
+        self.startup = StartupTimer()
+        self.startup.mark('imported')
         self.logger = logging.getLogger(self.__class__.__name__)
+        # Commands and frames may arrive at high rates, so their logs are rate limited
+        self.command_logger = RateLimitedLogger(self.logger)
+        self.frame_logger = RateLimitedLogger(self.logger)
 
-        self.service_publisher = ServicePublisher('mrobot-server', port)
-        self.websocket_server = WebSocketServer(self, hosts=get_all_ips(), port=port)
-        self.video_streamer = VideoStreamer(self,
-                                            video_config['device'],
-                                            video_config['width'],
-                                            video_config['height'],
-                                            video_config['test'])
+        server_config = config.get_app_server_config()
+        video_config = config.get_video_config()
+        motors_config = config.get_motors_config()
+        shared_memory_config = config.get_shared_memory_config()
+
+        port = server_config['port']
+        self.latency_stats = LatencyStats()
+        self.metrics = MetricsRegistry()
+        self.frames_produced = self.metrics.counter('frames_produced_total', 'Video frames pulled from the pipeline')
+        self.frames_encoded = self.metrics.counter('frames_encoded_total', 'Video frames encoded and serialized')
+        self.encode_time = self.metrics.histogram('encode_seconds', 'Time from pulling a frame to its encoded message')
+        self.command_count = self.metrics.counter('commands_total', 'Commands handled', ('command', 'success'))
+        self.command_time = self.metrics.histogram('command_seconds', 'Command handling time', ('command',),
+                                                   buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                                                            0.005, 0.01, 0.05))
+        self.metrics_server = None
+        if server_config['metrics-port'] > 0:
+            self.metrics_server = MetricsServer(self.metrics, server_config['metrics-port'])
+        self.port = port
+        # Created and published once the server is up, as zeroconf is slow to start
+        self.service_publisher = None
+        if server_config['compression'] not in COMPRESSION_POLICIES:
+            raise ControllerException(f'Unsupported compression policy: {server_config["compression"]}')
+        self.websocket_server = WebSocketServer(self, hosts=get_all_ips(), port=port,
+                                                max_pending_frames=server_config['frame-queue-size'],
+                                                max_viewers=server_config['max-viewers'],
+                                                latency_stats=self.latency_stats,
+                                                metrics=self.metrics,
+                                                compression=server_config['compression'],
+                                                max_message_size=server_config['max-message-size'],
+                                                max_queue=server_config['max-queue'],
+                                                write_limit=server_config['write-limit'],
+                                                tcp_nodelay=server_config['tcp-nodelay'],
+                                                send_buffer_size=server_config['send-buffer-size'],
+                                                receive_buffer_size=server_config['receive-buffer-size'])
+        # The pipeline is built in the background, once the server accepts connections
+        self.video_config = video_config
+        self.recording_config = config.get_recording_config()
+        self.rtp_config = config.get_rtp_config()
+        self.gating_config = config.get_gating_config()
+        self.supervisor_config = config.get_supervisor_config()
+        self.pipeline_supervisor = None
+        # Created with the pipeline, as H.264 gating requests keyframes from it
+        self.change_gate = None
+        self.video_streamer = None
+        self.video_ready = False
+        if motors_config['backend'] not in MOTOR_BACKENDS:
+            raise ControllerException(f'Unsupported motor backend: {motors_config["backend"]}')
+        self.motor_controller = MotorController(MOTOR_BACKENDS[motors_config['backend']](),
+                                                motors_config['rate'],
+                                                motors_config['deadman-timeout'])
+        self.adaptive_config = config.get_adaptive_config()
+        self.adaptive_quality = None
+        self.video_mode = video_config['mode']
+        self.frame_processor = None
+        if video_config['workers'] > 0 and self.video_mode == 'png':
+            self.frame_processor = FrameProcessor(video_config['workers'], video_config['executor'],
+                                                  video_config['max-in-flight'])
+        self.frame_ring = None
+        if shared_memory_config['enabled']:
+            if self.video_mode != 'png':
+                raise ControllerException('Shared memory frames require png mode, which decodes to RGB')
+            # The largest RGB frame, with rows padded to 4 bytes
+            max_frame_size = ((video_config['width'] * 3 + 3) & ~3) * video_config['height']
+            self.frame_ring = FrameRingPublisher(shared_memory_config['name'], shared_memory_config['slots'],
+                                                 max_frame_size)
+        self.default_video_transport = video_config['transport']
+        self.frame_sequence = 0
+        self.frame_stats = {'frames': 0, 'copies': 0, 'allocations': 0}
+        self.codec_config = None
         self.event_loop = None
+        # Encoded frames, from the streaming and encoder threads to the event loop
+        self.frame_handoff = None
         self.tasks = None
+        # Referenced until done, as the loop only keeps weak references to tasks
+        self.background_tasks = set()
 
         self.commands = {
             'video_start': self.video_start,
             'video_stop': self.video_stop,
+            'video_transport': self.set_video_transport,
+            'video_configure': self.video_configure,
+            'stats': self.stats,
+            'metrics': self.get_metrics,
+            'protocol': self.set_protocol,
+            'log_level': self.set_log_level,
+            'record_start': self.record_start,
+            'record_stop': self.record_stop,
+            'record_dump': self.record_dump,
+            'video_fault': self.video_fault,
             'move': self.move
         }
+        # Commands viewers are allowed to send; all others are reserved to the controlling client
+        self.viewer_commands = {'video_transport', 'stats', 'metrics', 'protocol'}
+        # Compact protocol handlers, taking the decoded payload values
+        self.compact_commands = {
+            COMPACT_MOVE: self.compact_move,
+            COMPACT_VIDEO_START: self.video_start,
+            COMPACT_VIDEO_STOP: self.video_stop
+        }
+        self.compact_command_names = {
+            COMPACT_MOVE: 'move',
+            COMPACT_VIDEO_START: 'video_start',
+            COMPACT_VIDEO_STOP: 'video_stop'
+        }
+        self.startup.mark('controller_created')
+
+    async def handle_message(self, message, session: ClientSession):
+        if is_compact(message):
+            return self.handle_compact_message(message, session)
 
-    async def handle_message(self, message):
+        start = time.perf_counter()
         success = False
         command = 'unknown'
         try:
             command, parameters = deserialize(message)
-            response = self.commands[command](parameters)
+            handler = self.commands[command]
+            if not session.is_controller and command not in self.viewer_commands:
+                raise ControllerException(f'Command {command} is reserved to the controlling client')
+            response = handler(parameters, session)
             success = True
+            self.count_command(command, success, start)
+            # Fire-and-forget commands don't get a response, unless they failed
+            if parameters.get('ack', True) is False:
+                return None
         except KeyError as e:
-            self.logger.warning(f'Invalid command: {e}')
+            self.command_logger.warning('Invalid command: %s', e)
             response = f'Invalid command: {e}'
         except ControllerException as e:
-            self.logger.warning(f'Command failed: {e}')
+            self.command_logger.warning('Command failed: %s', e)
             response = str(e)
         except DeserializationError as e:
-            self.logger.warning(f'received malformed message: {e}')
+            self.command_logger.warning('received malformed message: %s', e)
             response = str(e)
         except Exception as e:
-            self.logger.warning(f'Unknown error: {e}')
+            self.command_logger.warning('Unknown error: %s', e)
             response = str(e)
 
+        if not success:
+            # Unknown command names are not used as labels, so clients can't grow the metrics
+            self.count_command(command if command in self.commands else 'unknown', success, start)
         return serialize({'command': command, 'success': success, 'response': response})
 
-    async def on_client_disconnection(self):
-        self.logger.info(f'Client disconnected, stopping video')
-        self.video_streamer.pause()
+    def handle_compact_message(self, message: bytes, session: ClientSession):
+        """Fast path for the compact protocol: fixed layout packets, dispatched by command ID"""
+        start = time.perf_counter()
+        command_id = message[1]
+        flags = COMPACT_FLAG_ACK
+        success = False
+        try:
+            if session.protocol_version != PROTOCOL_COMPACT:
+                raise ControllerException('Compact protocol was not negotiated')
+            if not session.is_controller:
+                raise ControllerException('Compact commands are reserved to the controlling client')
+            command_id, flags, values = decode_compact(message)
+            self.compact_commands[command_id](values, session)
+            success = True
+        except (CompactDecodingError, ControllerException) as e:
+            self.command_logger.warning('Compact command %d failed: %s', command_id, e)
+        except Exception as e:
+            self.command_logger.warning('Unknown error in compact command %d: %s', command_id, e)
+
+        self.count_command(f'compact_{self.compact_command_names.get(command_id, "unknown")}', success, start)
+
+        # Only failures are reported for commands without the ack flag
+        if success and not flags & COMPACT_FLAG_ACK:
+            return None
+        return encode_compact_response(command_id, success)
+
+    def count_command(self, command: str, success: bool, start: float):
+        self.command_count.labels(command, str(success).lower()).inc()
+        self.command_time.labels(command).observe(time.perf_counter() - start)
+
+    async def on_client_connection(self, session: ClientSession):
+        session.video_transport = self.default_video_transport
+        session.protocol_version = PROTOCOL_MSGPACK
+        await session.send(serialize({'event': 'hello', 'protocols': list(PROTOCOL_VERSIONS),
+                                      'video_ready': self.video_ready}))
+        if self.video_mode == 'h264' and self.codec_config is not None:
+            self.logger.info('Sending codec configuration to new client')
+            caps_info = self.video_streamer.caps_info
+            await session.send(serialize_video_event(session.video_transport, 'video_nal',
+                                                     self.codec_config, self.frame_sequence,
+                                                     caps_info['width'], caps_info['height'],
+                                                     config=True))
+            self.video_streamer.request_keyframe()
+        if self.change_gate is not None:
+            self.change_gate.refresh()
+
+    async def on_client_disconnection(self, session: ClientSession):
+        if session.is_controller:
+            self.logger.info('Controlling client disconnected, stopping motors')
+            self.motor_controller.stop_motors()
+        if not self.websocket_server.sessions and self.video_ready:
+            self.logger.info(f'Last client disconnected, stopping video')
+            self.video_streamer.clear_rtp_destinations()
+            self.video_streamer.pause()
+
+    def handle_frame(self, frame: VideoFrame):
+        self.frames_produced.inc()
+        # Local consumers get every frame, static or not
+        if self.frame_ring is not None:
+            self.frame_ring.publish(frame.data, frame.width, frame.height, frame.stride, frame.pts,
+                                    frame.timestamps.get('capture'))
+            # The pipeline keeps playing for them, while the clients' video is stopped
+            if not self.video_streamer.playing:
+                return
+        if self.change_gate is not None and not self.change_gate.should_send(frame):
+            return
+        if self.video_mode == 'h264':
+            self.handle_h264_frame(frame)
+        elif self.video_mode == 'jpeg':
+            self.handle_jpeg_frame(frame)
+        else:
+            self.handle_png_frame(frame)
+
+    def handle_h264_frame(self, frame: VideoFrame):
+        if frame.keyframe:
+            codec_config = extract_parameter_sets(frame.data)
+            frame.count_copy()
+            if codec_config is not None:
+                self.codec_config = codec_config
 
-    def handle_frame(self, raw_data, _):
-        self.logger.debug('Sending frame')
+        self.send_frame(frame, 'video_nal', frame.data, keyframe=frame.keyframe)
 
-        image = Image.frombytes("RGB", (640, 480), raw_data)
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    def handle_jpeg_frame(self, frame: VideoFrame):
+        # Already encoded by the pipeline, so the mapped buffer is sent as is
+        self.send_frame(frame, 'video_jpeg', frame.data)
 
-        serialized_message = serialize({'event': 'video_frame', 'payload': img_base64})
-        asyncio.run_coroutine_threadsafe(self.websocket_server.send(serialized_message), self.event_loop)
+    def handle_png_frame(self, frame: VideoFrame):
+        if self.frame_processor is not None:
+            self.frame_processor.submit(frame, encode_png, (frame.width, frame.height, frame.stride),
+                                        self.on_png_encoded)
+        else:
+            self.on_png_encoded(frame, encode_png(frame.data, frame.width, frame.height, frame.stride))
+
+    def on_png_encoded(self, frame: VideoFrame, payload: bytes):
+        # Decoding into the PIL image copies the frame, and encoding allocates the PNG
+        frame.count_copy()
+        frame.count_allocation()
+        self.send_frame(frame, 'video_frame', payload)
+
+    def send_frame(self, frame: VideoFrame, event: str, payload, **fields):
+        frame.timestamps['encoded'] = self.latency_stats.now()
+        self.latency_stats.record(frame.timestamps, ('capture_to_pull', 'pull_to_encoded'))
+        self.frames_encoded.inc()
+        self.encode_time.observe((frame.timestamps['encoded'] - frame.timestamps['pull']) / 1e9)
+
+        # Serialize once per transport in use, and share the same message among all clients using it
+        sequence = self.next_frame_sequence()
+        messages = {}
+        for transport in self.websocket_server.get_video_transports():
+            if transport is not None:
+                messages[transport] = serialize_video_event(transport, event, payload, sequence,
+                                                            frame.width, frame.height, frame.pts,
+                                                            frame.timestamps, **fields)
+                frame.count_copy(VIDEO_TRANSPORT_COPIES[transport])
+
+        self.frame_stats['frames'] += 1
+        self.frame_logger.debug('Sending %s %d: %dx%d, %d transports', event, sequence, frame.width, frame.height,
+                                len(messages))
+        self.frame_stats['copies'] += frame.copies
+        self.frame_stats['allocations'] += frame.allocations
+
+        # Keep the frame's buffer mapped until the messages, which may reference it, were sent or dropped
+        frame.acquire()
+        self.frame_handoff.put(messages, frame)
+
+    def queue_frame(self, messages: dict, frame: VideoFrame):
+        try:
+            self.websocket_server.send_frame(messages, frame)
+        finally:
+            frame.release()
+
+    def next_frame_sequence(self) -> int:
+        sequence = self.frame_sequence
+        self.frame_sequence = (self.frame_sequence + 1) & 0xFFFFFFFF
+        return sequence
 
     async def run(self) -> None:
         self.logger.info('Starting server')
 
-        self.service_publisher.publish()
-
         self.event_loop = asyncio.get_running_loop()
-        self.tasks = await asyncio.gather(
-            asyncio.to_thread(self.video_streamer.start),
-            asyncio.create_task(self.websocket_server.start())
-        )
+        self.frame_handoff = LoopHandoff(self.event_loop, self.queue_frame)
+        # Accept connections and commands first; video becomes available later, with a ready event
+        await self.websocket_server.listen()
+        self.startup.mark('listening')
+
+        tasks = [
+            asyncio.create_task(self.websocket_server.start()),
+            asyncio.create_task(self.motor_controller.run()),
+            asyncio.create_task(self.prepare_video()),
+            asyncio.create_task(self.publish_service())
+        ]
+        if self.metrics_server is not None:
+            tasks.append(asyncio.create_task(self.metrics_server.start()))
+        self.tasks = asyncio.gather(*tasks)
+        await self.tasks
+
+    async def publish_service(self):
+        self.service_publisher = await asyncio.to_thread(ServicePublisher, 'mrobot-server', self.port)
+        await asyncio.to_thread(self.service_publisher.publish)
+        self.startup.mark('published')
+
+    def create_video_streamer(self):
+        """Imports GStreamer, builds and pre-rolls the pipeline. Runs in a worker thread."""
+        # Imported on its own first, so the import is timed as a startup phase
+        from .video_streamer import VideoStreamer  # noqa: F401
+        self.startup.mark('gstreamer_imported')
+        video_streamer = self.build_video_streamer()
+        self.startup.mark('pipeline_built')
+        video_streamer.preroll()
+        self.startup.mark('prerolled')
+        return video_streamer
+
+    def rebuild_video_streamer(self):
+        """Builds and pre-rolls a replacement of a failed pipeline. Runs in a worker thread."""
+        video_streamer = self.build_video_streamer()
+        video_streamer.preroll()
+        return video_streamer
+
+    def build_video_streamer(self):
+        from .video_streamer import VideoStreamer
+        video_streamer = VideoStreamer(self,
+                                       self.video_config['device'],
+                                       self.video_config['width'],
+                                       self.video_config['height'],
+                                       self.video_config['test'],
+                                       self.video_config['mode'],
+                                       self.video_config['jpeg-quality'],
+                                       self.video_config['keyframe-interval'],
+                                       recording=self.recording_config if self.recording_config['enabled'] else None,
+                                       rtp=self.rtp_config if self.rtp_config['enabled'] else None,
+                                       metrics=self.metrics,
+                                       keep_playing=self.frame_ring is not None)
+        video_streamer.set_quality({'framerate': self.video_config['framerate'],
+                                    'scale': self.video_config['scale'],
+                                    'roi': self.video_config['roi']})
+        return video_streamer
+
+    async def prepare_video(self):
+        try:
+            self.video_streamer = await asyncio.to_thread(self.create_video_streamer)
+        except Exception as e:
+            # Keep the robot drivable without video
+            self.logger.error(f'Failed to create the video pipeline, running without video: {e}')
+            return
+        if self.gating_config['enabled']:
+            self.change_gate = ChangeGate(self.video_mode, self.gating_config, self.video_streamer.request_keyframe,
+                                          self.metrics)
+        if self.adaptive_config['enabled']:
+            self.adaptive_quality = AdaptiveQualityController(self.video_streamer, self.websocket_server,
+                                                              self.adaptive_config, self.video_config)
+        self.video_ready = True
+        if self.recording_config['enabled'] and self.recording_config['autostart']:
+            self.video_streamer.start_recording()
+        self.startup.mark('video_ready')
+        self.startup.report()
+        if self.websocket_server.sessions:
+            self.websocket_server.send(serialize({'event': 'ready', 'mode': self.video_mode}))
+
+        if self.supervisor_config['enabled']:
+            self.pipeline_supervisor = PipelineSupervisor(self.video_streamer, self.rebuild_video_streamer,
+                                                          self.supervisor_config, self.metrics,
+                                                          on_failure=self.on_video_failure,
+                                                          on_recovered=self.on_video_recovered)
+
+        adaptive_task = None
+        if self.adaptive_quality is not None:
+            adaptive_task = asyncio.create_task(self.adaptive_quality.run())
+        try:
+            if self.pipeline_supervisor is not None:
+                await self.pipeline_supervisor.run()
+                error = None
+            else:
+                error = await self.video_streamer.start()
+        finally:
+            if adaptive_task is not None:
+                adaptive_task.cancel()
+        if error is not None:
+            # Keep the robot drivable without video
+            self.video_ready = False
+            self.logger.error(f'Video pipeline failed, running without video: {error}')
+            await asyncio.to_thread(self.video_streamer.stop)
+            if self.websocket_server.sessions:
+                self.websocket_server.send(serialize({'event': 'video_error', 'error': error,
+                                                      'recovering': False}))
+
+    async def on_video_failure(self, error: str):
+        # Commands wait for the recovered pipeline, which resumes the state the failed one had
+        self.video_ready = False
+        if self.websocket_server.sessions:
+            self.websocket_server.send(serialize({'event': 'video_error', 'error': error, 'recovering': True}))
+
+    async def on_video_recovered(self, video_streamer):
+        # A rebuilt pipeline replaces the failed one
+        self.video_streamer = video_streamer
+        if self.change_gate is not None:
+            self.change_gate.request_keyframe = video_streamer.request_keyframe
+            self.change_gate.refresh()
+        if self.adaptive_quality is not None:
+            self.adaptive_quality.video_streamer = video_streamer
+            self.adaptive_quality.apply(self.adaptive_quality.rung)
+        self.video_ready = True
+        if not self.websocket_server.sessions:
+            # The last client left while recovering
+            video_streamer.clear_rtp_destinations()
+            video_streamer.pause()
+            return
+        if self.video_mode == 'h264':
+            video_streamer.request_keyframe()
+        self.websocket_server.send(serialize({'event': 'ready', 'mode': self.video_mode}))
 
     def stop(self) -> None:
         if self.service_publisher:
             self.service_publisher.unpublish()
+        # Stopped first, as frames are published to the ring until the pipeline is down
         if self.video_streamer:
             self.video_streamer.stop()
+        if self.frame_processor:
+            self.frame_processor.stop()
+        if self.websocket_server:
+            self.websocket_server.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.frame_ring:
+            self.frame_ring.close()
         if self.tasks:
             self.tasks.cancel()
 
-    def video_start(self, _) -> str:
+    def video_start(self, parameters, _) -> str:
+        if not self.video_ready:
+            raise ControllerException('Video is not ready yet')
+        destination = self.get_rtp_destination(parameters)
+        if destination is not None:
+            try:
+                self.video_streamer.add_rtp_destination(*destination)
+            except Exception as e:
+                raise ControllerException(str(e))
         self.logger.info(f'Starting video')
+        if self.change_gate is not None:
+            self.change_gate.refresh()
         self.video_streamer.play()
+        if self.video_mode == 'h264':
+            self.video_streamer.request_keyframe()
+        if destination is not None:
+            return f'video started, sending RTP to {destination[0]}:{destination[1]}'
         return f'video started'
 
-    def video_stop(self, _) -> str:
+    def video_stop(self, parameters, _) -> str:
+        if not self.video_ready:
+            raise ControllerException('Video is not ready yet')
+        destination = self.get_rtp_destination(parameters)
+        if destination is not None:
+            # Only this destination stops; the pipeline keeps running for the others and the websocket clients
+            self.video_streamer.remove_rtp_destination(*destination)
+            return f'stopped sending RTP to {destination[0]}:{destination[1]}'
         self.logger.info(f'Stopping video')
+        self.video_streamer.clear_rtp_destinations()
         self.video_streamer.pause()
         return 'video stopped'
 
-    def move(self, parameters) -> str:
-        self.logger.info(f'Got move command: {parameters}')
\ No newline at end of file
+    def get_rtp_destination(self, parameters) -> tuple | None:
+        # Compact packets carry no parameters, and without a host, video is only sent over the websocket
+        if not isinstance(parameters, dict) or not parameters.get('host'):
+            return None
+        if not self.rtp_config['enabled']:
+            raise ControllerException('RTP output is not enabled')
+        try:
+            port = int(parameters.get('port', self.rtp_config['port']))
+        except (TypeError, ValueError) as e:
+            raise ControllerException(f'Invalid RTP port: {e}')
+        if not 0 < port < 65536:
+            raise ControllerException(f'Invalid RTP port: {port}')
+        return str(parameters['host']), port
+
+    def video_configure(self, parameters, _) -> dict:
+        if not self.video_ready:
+            raise ControllerException('Video is not ready yet')
+        if self.video_mode == 'h264':
+            raise ControllerException('Output configuration requires a raw video mode (png or jpeg)')
+
+        output_config = {}
+        try:
+            if 'fps' in parameters:
+                output_config['framerate'] = int(parameters['fps'])
+                if output_config['framerate'] < 0:
+                    raise ValueError('fps must not be negative')
+            if 'scale' in parameters:
+                output_config['scale'] = float(parameters['scale'])
+                if not 0.0 < output_config['scale'] <= 1.0:
+                    raise ValueError('scale must be in (0, 1]')
+            if 'roi' in parameters:
+                roi = parameters['roi']
+                if roi is not None and (not isinstance(roi, (list, tuple)) or len(roi) != 4):
+                    raise ValueError('roi must be [x, y, width, height] or null')
+                output_config['roi'] = roi
+            if self.adaptive_quality is not None:
+                self.adaptive_quality.configure(output_config)
+            else:
+                self.video_streamer.set_quality(output_config)
+        except (TypeError, ValueError) as e:
+            raise ControllerException(f'Invalid video configuration: {e}')
+
+        self.logger.info(f'Video output configured: {output_config}')
+        return self.video_streamer.get_output_config()
+
+    def check_recording(self):
+        if not self.recording_config['enabled']:
+            raise ControllerException('Recording is not enabled')
+        if not self.video_ready:
+            raise ControllerException('Video is not ready yet')
+
+    def record_start(self, *_) -> str:
+        self.check_recording()
+        self.video_streamer.start_recording()
+        return 'recording started'
+
+    def record_stop(self, *_) -> str:
+        self.check_recording()
+        self.video_streamer.stop_recording()
+        return 'recording stopped'
+
+    def record_dump(self, _, session: ClientSession) -> str:
+        """Moves the recorded segments aside in the background, and reports them with a record_dump event"""
+        self.check_recording()
+        task = asyncio.create_task(self.dump_recording(session))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return 'dumping recording'
+
+    async def dump_recording(self, session: ClientSession):
+        try:
+            path, files = await asyncio.to_thread(dump_segments, self.recording_config['directory'],
+                                                  self.recording_config['dump-directory'])
+            self.logger.info(f'Dumped {len(files)} recorded segments to {path}')
+            event = {'event': 'record_dump', 'success': True, 'path': path, 'files': files}
+        except OSError as e:
+            self.logger.error(f'Failed to dump the recording: {e}')
+            event = {'event': 'record_dump', 'success': False, 'error': str(e)}
+        # The client may have disconnected while the segments were moved
+        if self.websocket_server.sessions.get(session.websocket) is session:
+            await session.send(serialize(event))
+
+    def video_fault(self, parameters, _) -> str:
+        if not self.video_config['test']:
+            raise ControllerException('Faults can only be injected into the test source')
+        if not self.video_ready:
+            raise ControllerException('Video is not ready yet')
+        fault = parameters.get('fault')
+        try:
+            self.video_streamer.inject_fault(fault)
+        except Exception as e:
+            raise ControllerException(str(e))
+        return f'{fault} fault injected'
+
+    def set_video_transport(self, parameters, session: ClientSession) -> str:
+        transport = parameters.get('format')
+        if transport not in VIDEO_TRANSPORTS:
+            raise ControllerException(f'Unsupported video transport: {transport}')
+        self.logger.info(f'Setting video transport of {session.websocket.remote_address} to {transport}')
+        session.video_transport = transport
+        return f'video transport set to {transport}'
+
+    def stats(self, *_) -> dict:
+        frames = max(self.frame_stats['frames'], 1)
+        return {
+            'frames': self.frame_stats['frames'],
+            'copies_per_frame': self.frame_stats['copies'] / frames,
+            'allocations_per_frame': self.frame_stats['allocations'] / frames,
+            'clients': self.websocket_server.get_stats()['clients'],
+            'quality': self.adaptive_quality.get_stats() if self.adaptive_quality is not None else None,
+            'latency': self.latency_stats.get_stats(),
+            'frame_processor': self.frame_processor.get_stats() if self.frame_processor is not None else None,
+            'motors': self.motor_controller.get_stats(),
+            'recording': self.video_streamer.get_recording_stats() if self.video_streamer is not None else None,
+            'gating': self.change_gate.get_stats() if self.change_gate is not None else None,
+            'frame_ring': self.frame_ring.get_stats() if self.frame_ring is not None else None,
+            'frame_handoff': self.frame_handoff.get_stats() if self.frame_handoff is not None else None,
+            'rtp_destinations': self.video_streamer.get_rtp_destinations() if self.video_streamer is not None else [],
+            'supervisor': self.pipeline_supervisor.get_stats() if self.pipeline_supervisor is not None else None,
+            'startup': self.startup.get_stats()
+        }
+
+    def get_metrics(self, *_) -> dict:
+        return self.metrics.get_stats()
+
+    def set_protocol(self, parameters, session: ClientSession) -> str:
+        version = parameters.get('version')
+        if version not in PROTOCOL_VERSIONS:
+            raise ControllerException(f'Unsupported protocol version: {version}')
+        session.protocol_version = version
+        return f'protocol version set to {version}'
+
+    def set_log_level(self, parameters, _) -> str:
+        level = str(parameters.get('level', '')).upper()
+        if level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+            raise ControllerException(f'Invalid log level: {parameters.get("level")}')
+        # Without a logger name, the root logger is set
+        name = parameters.get('logger')
+        logging.getLogger(name).setLevel(level)
+        self.logger.info(f'Log level of {name or "root"} set to {level}')
+        return f'log level set to {level}'
+
+    def compact_move(self, values, _):
+        left, right = values
+        self.motor_controller.set_setpoint(max(-1.0, left / COMPACT_SPEED_SCALE),
+                                           max(-1.0, right / COMPACT_SPEED_SCALE))
+
+    def move(self, parameters, _) -> str:
+        try:
+            left = float(parameters['left'])
+            right = float(parameters['right'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ControllerException(f'Invalid move parameters: {e}')
+        if not (-1.0 <= left <= 1.0 and -1.0 <= right <= 1.0):
+            raise ControllerException(f'Motor speeds must be between -1 and 1')
+
+        self.motor_controller.set_setpoint(left, right)
+        return 'ok'
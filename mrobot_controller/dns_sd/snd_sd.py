@@ -1,5 +1,4 @@
 import netifaces
-from zeroconf import ServiceInfo, Zeroconf
 import logging
 
 
@@ -10,6 +9,9 @@ def get_all_ips():
 class ServicePublisher:
 
     def __init__(self, service_name: str, port: int):
+        # zeroconf takes long to import, and is only needed once the server is up
+        from zeroconf import ServiceInfo, Zeroconf
+
         self.logger = logging.getLogger(f'{self.__class__.__name__}-{service_name}')
         self.zeroconf = Zeroconf()
         self.service_name = f'_{service_name}._websocket._tcp.local.'
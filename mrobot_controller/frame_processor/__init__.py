@@ -0,0 +1,2 @@
+from .frame_processor import FrameProcessor
+from .encoders import encode_png
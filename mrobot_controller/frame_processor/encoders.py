@@ -0,0 +1,11 @@
+import io
+
+
+def encode_png(data, width: int, height: int, stride: int) -> bytes:
+    # PIL is only needed in png mode, so it's imported on the first frame rather than at startup
+    from PIL import Image
+    # The row stride may be padded beyond width * 3
+    image = Image.frombuffer("RGB", (width, height), data, "raw", "RGB", stride, 1)
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return buffered.getvalue()
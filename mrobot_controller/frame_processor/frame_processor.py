@@ -0,0 +1,104 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from ..log_utils import RateLimitedLogger
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor
+}
+
+
+class FrameProcessor:
+    """
+    Runs frame encoding on a pool of workers, off the GStreamer streaming thread.
+
+    At most `max_in_flight` frames are processed at once; frames arriving while the pool is saturated
+    are dropped, so a slow encoder never backs up the pipeline. Results are delivered in the order the
+    frames were submitted, regardless of which worker finished first.
+    """
+    def __init__(self, workers: int, executor: str = 'thread', max_in_flight: int = 4):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.frame_logger = RateLimitedLogger(self.logger)
+        if executor not in EXECUTORS:
+            raise ValueError(f'Unsupported frame processor executor: {executor}')
+
+        self.executor_type = executor
+        self.executor = EXECUTORS[executor](max_workers=workers)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.results = {}
+        self.submitted = 0
+        self.delivered = 0
+
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.frames_failed = 0
+
+    @property
+    def copies_input(self) -> bool:
+        # Process workers can't share the mapped buffer, so frame data is pickled over
+        return self.executor_type == 'process'
+
+    def submit(self, frame, function, args: tuple, on_result) -> bool:
+        """
+        Process `frame` with `function(data, *args)`, and call `on_result(frame, result)` in submission order.
+        `frame` is held until its result was delivered. Returns False if the frame was dropped.
+        """
+        if not self.in_flight.acquire(blocking=False):
+            self.frames_dropped += 1
+            return False
+
+        frame.acquire()
+        data = bytes(frame.data) if self.copies_input else frame.data
+        if self.copies_input:
+            frame.count_copy()
+
+        with self.lock:
+            sequence = self.submitted
+            self.submitted += 1
+        try:
+            future = self.executor.submit(function, data, *args)
+        except RuntimeError as e:
+            # The executor was shut down
+            self.frame_logger.debug('Frame not processed: %s', e)
+            future = None
+        if future is None:
+            self.on_done(sequence, frame, on_result, None)
+        else:
+            future.add_done_callback(partial(self.on_done, sequence, frame, on_result))
+        return True
+
+    def on_done(self, sequence: int, frame, on_result, future):
+        with self.lock:
+            self.results[sequence] = (frame, on_result, future)
+            # Deliver under the lock, so results are handed over one at a time and in order
+            while self.delivered in self.results:
+                self.deliver(*self.results.pop(self.delivered))
+                self.delivered += 1
+
+    def deliver(self, frame, on_result, future):
+        try:
+            if future is None or future.cancelled():
+                return
+            result = future.result()
+            self.frames_processed += 1
+            on_result(frame, result)
+        except Exception as e:
+            self.frames_failed += 1
+            self.frame_logger.warning('Frame processing failed: %s', e)
+        finally:
+            frame.release()
+            self.in_flight.release()
+
+    def get_stats(self) -> dict:
+        return {
+            'frames_processed': self.frames_processed,
+            'frames_dropped': self.frames_dropped,
+            'frames_failed': self.frames_failed,
+            'in_flight': self.submitted - self.delivered
+        }
+
+    def stop(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
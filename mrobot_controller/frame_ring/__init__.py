@@ -0,0 +1 @@
+from .frame_ring import FrameRingPublisher, FrameRingReader
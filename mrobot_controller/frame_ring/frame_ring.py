@@ -0,0 +1,183 @@
+import logging
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+FRAME_RING_MAGIC = b'MRFR'
+FRAME_RING_VERSION = 1
+
+# Magic, version, slots, slot data size, sequence of the latest complete frame
+RING_HEADER = struct.Struct('<4sHxxIIQ')
+# Sequence (0 while being written), frame size, width, height, stride, PTS and capture time (ns, -1 if unknown)
+SLOT_HEADER = struct.Struct('<QIIIIqq')
+# Headers are padded to a cache line, which keeps frame data aligned too
+HEADER_SIZE = 64
+SEQUENCE_OFFSET = RING_HEADER.size - 8
+
+
+def align(size: int) -> int:
+    return (size + HEADER_SIZE - 1) & ~(HEADER_SIZE - 1)
+
+
+class FrameRingPublisher:
+    """
+    Publishes raw frames into a shared memory ring of `slots` frames, for consumers in other processes.
+
+    Frames are written in turn into the slots, and the ring header points to the latest complete one.
+    A slot's sequence number is cleared before the slot is overwritten, and set once the frame is complete,
+    so readers can tell a torn frame (a seqlock). The producer never waits for readers: a reader that falls
+    behind by more than `slots - 1` frames only gets its read rejected.
+    """
+    def __init__(self, name: str, slots: int, max_frame_size: int):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.name = name
+        self.slots = slots
+        self.slot_size = align(max_frame_size)
+        self.sequence = 0
+        self.frames_published = 0
+        self.frames_oversized = 0
+
+        size = HEADER_SIZE + slots * (HEADER_SIZE + self.slot_size)
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left over by a previous run which didn't shut down cleanly
+            self.logger.warning(f'Replacing stale shared memory {name}')
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+
+        self.buffer = self.memory.buf
+        self.buffer[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        RING_HEADER.pack_into(self.buffer, 0, FRAME_RING_MAGIC, FRAME_RING_VERSION, slots, self.slot_size, 0)
+        self.logger.info(f'Publishing frames to shared memory {name}: {slots} slots of {self.slot_size} bytes')
+
+    def slot_offset(self, sequence: int) -> int:
+        return HEADER_SIZE + (sequence % self.slots) * (HEADER_SIZE + self.slot_size)
+
+    def publish(self, data, width: int, height: int, stride: int, pts: int | None = None,
+                capture_time: int | None = None) -> bool:
+        if self.buffer is None:
+            # Closed
+            return False
+        size = memoryview(data).nbytes
+        if size > self.slot_size:
+            self.frames_oversized += 1
+            return False
+
+        sequence = self.sequence + 1
+        offset = self.slot_offset(sequence)
+        # Invalidate the slot first, so a reader copying the previous frame from it notices
+        SLOT_HEADER.pack_into(self.buffer, offset, 0, 0, 0, 0, 0, -1, -1)
+        self.buffer[offset + HEADER_SIZE:offset + HEADER_SIZE + size] = data
+        SLOT_HEADER.pack_into(self.buffer, offset, sequence, size, width, height, stride,
+                              -1 if pts is None else pts, -1 if capture_time is None else capture_time)
+        struct.pack_into('<Q', self.buffer, SEQUENCE_OFFSET, sequence)
+        self.sequence = sequence
+        self.frames_published += 1
+        return True
+
+    def get_stats(self) -> dict:
+        return {
+            'name': self.name,
+            'frames_published': self.frames_published,
+            'frames_oversized': self.frames_oversized
+        }
+
+    def close(self):
+        if self.buffer is None:
+            return
+        self.buffer.release()
+        self.buffer = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class FrameRingReader:
+    """
+    Reads the latest frame published by a FrameRingPublisher, from another process.
+
+    read_latest() copies the frame into a buffer owned by the reader, and validates it wasn't overwritten
+    meanwhile. view_latest() returns a view of the shared memory itself with no copy at all; the view is only
+    valid while is_valid() returns True for its sequence, so it should be checked after processing the frame.
+    """
+    def __init__(self, name: str):
+        self.memory = shared_memory.SharedMemory(name)
+        try:
+            # The publisher owns the memory; without this, the reader would unlink it on exit
+            resource_tracker.unregister(self.memory._name, 'shared_memory')
+        except Exception:
+            pass
+        self.buffer = self.memory.buf
+        magic, version, self.slots, self.slot_size, _ = RING_HEADER.unpack_from(self.buffer, 0)
+        if magic != FRAME_RING_MAGIC or version != FRAME_RING_VERSION:
+            self.close()
+            raise ValueError(f'{name} is not a version {FRAME_RING_VERSION} frame ring')
+        self.frame = bytearray(self.slot_size)
+        self.last_sequence = 0
+
+    def slot_offset(self, sequence: int) -> int:
+        return HEADER_SIZE + (sequence % self.slots) * (HEADER_SIZE + self.slot_size)
+
+    def latest_sequence(self) -> int:
+        return struct.unpack_from('<Q', self.buffer, SEQUENCE_OFFSET)[0]
+
+    def read_slot(self, sequence: int) -> dict | None:
+        slot_sequence, size, width, height, stride, pts, capture_time = \
+            SLOT_HEADER.unpack_from(self.buffer, self.slot_offset(sequence))
+        if slot_sequence != sequence:
+            return None
+        return {
+            'sequence': sequence,
+            'size': size,
+            'width': width,
+            'height': height,
+            'stride': stride,
+            'pts': None if pts < 0 else pts,
+            'capture_time': None if capture_time < 0 else capture_time
+        }
+
+    def is_valid(self, sequence: int) -> bool:
+        slot_sequence = struct.unpack_from('<Q', self.buffer, self.slot_offset(sequence))[0]
+        return slot_sequence == sequence
+
+    def view_latest(self) -> tuple | None:
+        """The latest frame's metadata and a view of its data in the shared memory, or None if there is none"""
+        sequence = self.latest_sequence()
+        info = self.read_slot(sequence) if sequence else None
+        if info is None:
+            return None
+        offset = self.slot_offset(sequence) + HEADER_SIZE
+        self.last_sequence = sequence
+        return info, self.buffer[offset:offset + info['size']]
+
+    def read_latest(self, retries: int = 3) -> tuple | None:
+        """A consistent copy of the latest frame's metadata and data, or None if there is none"""
+        for _ in range(retries):
+            latest = self.view_latest()
+            if latest is None:
+                return None
+            info, view = latest
+            self.frame[:info['size']] = view
+            view.release()
+            # The producer may have lapped the ring while copying
+            if self.is_valid(info['sequence']):
+                return info, memoryview(self.frame)[:info['size']]
+        return None
+
+    def wait_next(self, timeout: float = 1.0, interval: float = 0.002) -> tuple | None:
+        """Read the first frame newer than the last one read, polling until `timeout` seconds passed"""
+        deadline = time.monotonic() + timeout
+        while self.latest_sequence() <= self.last_sequence:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+        return self.read_latest()
+
+    def close(self):
+        if self.buffer is None:
+            return
+        self.buffer.release()
+        self.buffer = None
+        self.memory.close()
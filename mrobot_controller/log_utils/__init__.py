@@ -0,0 +1 @@
+from .rate_limited_logger import RateLimitedLogger
@@ -0,0 +1,41 @@
+import logging
+import time
+
+
+class RateLimitedLogger:
+    """
+    Logger wrapper for hot paths: each message (by its format string) is emitted at most once per `interval`
+    seconds, with the number of suppressed repetitions appended. Arguments are formatted lazily, and only
+    when the message is actually emitted.
+    """
+    def __init__(self, logger: logging.Logger, interval: float = 5.0):
+        self.logger = logger
+        self.interval = interval
+        self.last_emitted = {}
+        self.suppressed = {}
+
+    def log(self, level: int, msg: str, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        now = time.monotonic()
+        last_emitted = self.last_emitted.get(msg)
+        if last_emitted is not None and now - last_emitted < self.interval:
+            self.suppressed[msg] = self.suppressed.get(msg, 0) + 1
+            return
+
+        self.last_emitted[msg] = now
+        suppressed = self.suppressed.pop(msg, 0)
+        if suppressed:
+            self.logger.log(level, msg + ' (%d similar messages suppressed)', *args, suppressed, stacklevel=3)
+        else:
+            self.logger.log(level, msg, *args, stacklevel=3)
+
+    def debug(self, msg: str, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg: str, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg: str, *args):
+        self.log(logging.WARNING, msg, *args)
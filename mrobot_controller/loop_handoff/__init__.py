@@ -0,0 +1 @@
+from .loop_handoff import LoopHandoff
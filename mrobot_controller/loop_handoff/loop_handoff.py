@@ -0,0 +1,47 @@
+import logging
+from collections import deque
+
+
+class LoopHandoff:
+    """
+    Hands items from other threads over to a callback running on an asyncio loop.
+
+    call_soon_threadsafe() wakes the loop up through its self-pipe on every call. Items are instead appended to a
+    deque, which needs no lock, and the loop is only woken up when no wakeup is pending: items put before the loop
+    got to the callback are handled in the same wakeup.
+    """
+    def __init__(self, loop, callback):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.loop = loop
+        self.callback = callback
+        self.items = deque()
+        self.scheduled = False
+        self.items_handled = 0
+        self.wakeups = 0
+
+    def put(self, *item):
+        """Called from any thread"""
+        self.items.append(item)
+        if not self.scheduled:
+            self.scheduled = True
+            self.wakeups += 1
+            self.loop.call_soon_threadsafe(self.drain)
+
+    def drain(self):
+        # Cleared first: an item put from now on is either drained below, or schedules another wakeup
+        self.scheduled = False
+        items = self.items
+        while items:
+            item = items.popleft()
+            self.items_handled += 1
+            try:
+                self.callback(*item)
+            except Exception:
+                self.logger.exception('Failed to handle item')
+
+    def get_stats(self) -> dict:
+        return {
+            'items': self.items_handled,
+            'wakeups': self.wakeups,
+            'pending': len(self.items)
+        }
@@ -0,0 +1,4 @@
+from .latency import LatencyStats, RollingHistogram
+from .prometheus import MetricsRegistry, Counter, Gauge, Histogram
+from .metrics_server import MetricsServer
+from .startup import StartupTimer
@@ -0,0 +1,60 @@
+import time
+
+
+class RollingHistogram:
+    """
+    Percentiles over the last `size` samples.
+    Samples are kept in a preallocated ring, so recording from the streaming thread needs no lock.
+    """
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.samples = []
+        self.index = 0
+        self.count = 0
+
+    def record(self, value: float):
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            self.samples[self.index] = value
+            self.index = (self.index + 1) % self.size
+        self.count += 1
+
+    def percentiles(self, percentiles=(50, 95, 99)) -> dict:
+        samples = sorted(self.samples[:])
+        if not samples:
+            return {f'p{percentile}': None for percentile in percentiles}
+        return {f'p{percentile}': samples[min(len(samples) - 1, len(samples) * percentile // 100)]
+                for percentile in percentiles}
+
+
+class LatencyStats:
+    """
+    Rolling latency histograms of the video path stages, in milliseconds.
+    Frame timestamps are `time.monotonic_ns()` values, keyed by the point they were taken at:
+    `capture`, `pull`, `encoded`, `enqueued` and `sent`.
+    """
+    STAGES = {
+        'capture_to_pull': ('capture', 'pull'),
+        'pull_to_encoded': ('pull', 'encoded'),
+        'encoded_to_enqueued': ('encoded', 'enqueued'),
+        'enqueued_to_sent': ('enqueued', 'sent'),
+        'capture_to_sent': ('capture', 'sent')
+    }
+
+    def __init__(self, size: int = 1024):
+        self.histograms = {stage: RollingHistogram(size) for stage in self.STAGES}
+
+    @staticmethod
+    def now() -> int:
+        return time.monotonic_ns()
+
+    def record(self, timestamps: dict, stages):
+        for stage in stages:
+            start, end = self.STAGES[stage]
+            if timestamps.get(start) is not None and timestamps.get(end) is not None:
+                self.histograms[stage].record((timestamps[end] - timestamps[start]) / 1e6)
+
+    def get_stats(self) -> dict:
+        return {stage: {'count': histogram.count, **histogram.percentiles()}
+                for stage, histogram in self.histograms.items()}
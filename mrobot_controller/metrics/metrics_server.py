@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from .prometheus import MetricsRegistry
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server exposing the registry at `/metrics`, for Prometheus to scrape.
+    Runs on the event loop on its own port, so scraping never touches the websocket server.
+    """
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = '0.0.0.0'):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Headers are not needed, but have to be consumed before responding
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] != 'GET':
+                status, content_type, body = '405 Method Not Allowed', 'text/plain', b'Method not allowed\n'
+            elif parts[1].split('?')[0] != '/metrics':
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+            else:
+                status, content_type, body = '200 OK', MetricsRegistry.CONTENT_TYPE, self.registry.render().encode()
+
+            writer.write(f'HTTP/1.1 {status}\r\n'
+                         f'Content-Type: {content_type}\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self.logger.debug('Metrics request failed: %s', e)
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_request, self.host, self.port)
+        self.logger.info(f'Metrics available on http://{self.host}:{self.port}/metrics')
+        async with self.server:
+            await self.server.serve_forever()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
@@ -0,0 +1,211 @@
+import bisect
+import os
+import resource
+import time
+from abc import ABC, abstractmethod
+
+# Seconds, covering both a fast JPEG passthrough and a slow software PNG encode
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def escape_label_value(value) -> str:
+    # As required by the text exposition format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(ABC):
+    """
+    A metric with optional labels. Each label combination gets its own child, created on first use.
+    Children are updated without a lock: every metric on the frame path is written by a single thread,
+    and readers only ever see a slightly stale value.
+    With `function`, an unlabelled metric is instead evaluated whenever it's read.
+    """
+    TYPE = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.function = function
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            # setdefault is atomic, so racing writers still end up sharing one child
+            child = self.children.setdefault(values, self.create_child())
+        return child
+
+    @abstractmethod
+    def create_child(self):
+        pass
+
+    def samples(self):
+        """Yields (suffix, labels, value) tuples"""
+        if self.function is not None:
+            yield '', '', self.function()
+            return
+        for values, child in list(self.children.items()):
+            yield '', format_labels(self.label_names, values), child.value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        lines += [f'{self.name}{suffix}{labels} {value}' for suffix, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+    def get_stats(self):
+        if self.function is not None:
+            return self.function()
+        if not self.label_names:
+            return self.labels().get_stats()
+        return {','.join(str(value) for value in values): child.get_stats()
+                for values, child in list(self.children.items())}
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get_stats(self):
+        return self.value
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def create_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class GaugeChild(CounterChild):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Gauge(Metric):
+    """A gauge, either set directly or, with `function`, evaluated whenever it's read"""
+    TYPE = 'gauge'
+
+    def create_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+
+class HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # Per bucket (non cumulative) counts, with a last +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list:
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def get_stats(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.cumulative_counts()))}
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            for bound, count in zip([*map(str, self.buckets), '+Inf'], child.cumulative_counts()):
+                yield '_bucket', format_labels(self.label_names, values, f'le="{bound}"'), count
+            yield '_sum', format_labels(self.label_names, values), child.sum
+            yield '_count', format_labels(self.label_names, values), child.count
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak RSS, where the current one isn't available (kB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MetricsRegistry:
+    """
+    Named metrics, rendered in the Prometheus text exposition format.
+    Metrics are created once at startup, so the registry itself is never modified on the hot paths.
+    """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, namespace: str = 'mrobot'):
+        self.namespace = namespace
+        self.metrics = {}
+        self.start_time = time.time()
+
+        self.counter('process_cpu_seconds_total', 'User and system CPU time of the process',
+                     function=lambda: sum(os.times()[:2]))
+        self.gauge('process_resident_memory_bytes', 'Resident memory size', function=get_rss_bytes)
+        self.gauge('process_uptime_seconds', 'Time since the process started',
+                   function=lambda: time.time() - self.start_time)
+
+    def register(self, metric: Metric) -> Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            # Registering the same metric again shares it, e.g. between a pipeline and its rebuilt replacement
+            if type(existing) is type(metric) and existing.label_names == metric.label_names:
+                return existing
+            raise ValueError(f'Metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = (), function=None) -> Counter:
+        return self.register(Counter(f'{self.namespace}_{name}', documentation, labels, function))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = (), function=None) -> Gauge:
+        return self.register(Gauge(f'{self.namespace}_{name}', documentation, labels, function))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(f'{self.namespace}_{name}', documentation, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in list(self.metrics.values())) + '\n'
+
+    def get_stats(self) -> dict:
+        prefix = f'{self.namespace}_'
+        return {name.removeprefix(prefix): metric.get_stats() for name, metric in list(self.metrics.items())}
@@ -0,0 +1,37 @@
+import logging
+import os
+import time
+
+
+def get_process_age() -> float | None:
+    """Seconds since the process started, including the interpreter startup and imports"""
+    try:
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces, so fields are counted from its closing parenthesis
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """
+    Time of each startup phase (e.g. server listening, pipeline built, video ready), in seconds since the
+    process started. Where the process start time isn't available, times are relative to the timer's creation.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.start = time.monotonic() - (get_process_age() or 0.0)
+        self.phases = {}
+
+    def mark(self, phase: str):
+        self.phases[phase] = time.monotonic() - self.start
+
+    def get_stats(self) -> dict:
+        return dict(self.phases)
+
+    def report(self):
+        self.logger.info('Startup times: ' + ', '.join(f'{phase} {seconds:.3f}s'
+                                                       for phase, seconds in self.phases.items()))
@@ -0,0 +1,2 @@
+from .motor_backend import MotorBackend, SimulatedMotorBackend, MOTOR_BACKENDS
+from .motor_controller import MotorController
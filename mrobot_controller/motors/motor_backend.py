@@ -0,0 +1,37 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+
+
+class MotorBackend(ABC):
+    """Output stage of the motor controller. Speeds are in the range [-1, 1], negative is reverse"""
+    @abstractmethod
+    def set_speeds(self, left: float, right: float):
+        pass
+
+    def stop(self):
+        self.set_speeds(0.0, 0.0)
+
+    def close(self):
+        self.stop()
+
+
+class SimulatedMotorBackend(MotorBackend):
+    """Keeps the applied speeds in memory, for measuring the control path without hardware"""
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.left = 0.0
+        self.right = 0.0
+        self.updates = 0
+        self.last_update = None
+
+    def set_speeds(self, left: float, right: float):
+        self.left = left
+        self.right = right
+        self.updates += 1
+        self.last_update = time.monotonic()
+
+
+MOTOR_BACKENDS = {
+    'simulated': SimulatedMotorBackend
+}
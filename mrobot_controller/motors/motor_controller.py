@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from .motor_backend import MotorBackend
+from ..metrics import RollingHistogram
+
+
+class MotorController:
+    """
+    Applies motor setpoints on a fixed-rate control tick.
+
+    `move` commands only update the pending setpoint, so commands arriving faster than the tick rate
+    are coalesced, and only the latest one is applied. When no command arrived for `deadman_timeout`
+    seconds, the motors are stopped.
+    """
+    def __init__(self, backend: MotorBackend, rate: float = 50.0, deadman_timeout: float = 0.5):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.backend = backend
+        self.period = 1.0 / rate
+        self.deadman_timeout = deadman_timeout
+
+        self.setpoint = None
+        self.last_command = None
+        self.moving = False
+
+        self.commands = 0
+        self.coalesced = 0
+        self.applied = 0
+        self.deadman_stops = 0
+        self.ticks = 0
+        self.latency = RollingHistogram()
+        self.jitter = RollingHistogram()
+
+    def set_setpoint(self, left: float, right: float):
+        now = time.monotonic()
+        if self.setpoint is not None:
+            self.coalesced += 1
+        self.setpoint = (left, right, now)
+        self.last_command = now
+        self.commands += 1
+
+    def stop_motors(self):
+        self.setpoint = None
+        self.backend.stop()
+        self.moving = False
+
+    def tick(self, now: float):
+        self.ticks += 1
+        if self.setpoint is not None:
+            left, right, received = self.setpoint
+            self.setpoint = None
+            self.backend.set_speeds(left, right)
+            self.applied += 1
+            self.moving = left != 0.0 or right != 0.0
+            self.latency.record((time.monotonic() - received) * 1000)
+        elif self.moving and now - self.last_command > self.deadman_timeout:
+            self.logger.warning(f'No move command for {self.deadman_timeout}s, stopping motors')
+            self.stop_motors()
+            self.deadman_stops += 1
+
+    async def run(self):
+        self.logger.info(f'Control tick running at {1 / self.period:.0f} Hz')
+        next_tick = time.monotonic()
+        try:
+            while True:
+                # Schedule against absolute deadlines, so the tick doesn't drift with processing time
+                next_tick += self.period
+                await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+                now = time.monotonic()
+                self.jitter.record((now - next_tick) * 1000)
+                if now - next_tick > self.period:
+                    # Fell behind (e.g. the loop was blocked); skip the missed ticks
+                    next_tick = now
+                self.tick(now)
+        finally:
+            self.stop_motors()
+            self.backend.close()
+
+    def get_stats(self) -> dict:
+        return {
+            'commands': self.commands,
+            'coalesced': self.coalesced,
+            'applied': self.applied,
+            'deadman_stops': self.deadman_stops,
+            'ticks': self.ticks,
+            'latency': self.latency.percentiles(),
+            'jitter': self.jitter.percentiles()
+        }
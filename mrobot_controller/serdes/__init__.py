@@ -1,2 +1,5 @@
 from .deserializer import deserialize, DeserializationError
-from .serializer import serialize
\ No newline at end of file
+from .serializer import serialize, serialize_video_event, VIDEO_TRANSPORTS, VIDEO_TRANSPORT_COPIES
+from .compact import is_compact, decode_compact, encode_compact, encode_compact_response, CompactDecodingError, \
+    PROTOCOL_VERSIONS, PROTOCOL_MSGPACK, PROTOCOL_COMPACT, COMPACT_MARKER, \
+    COMPACT_MOVE, COMPACT_VIDEO_START, COMPACT_VIDEO_STOP, COMPACT_FLAG_ACK, COMPACT_SPEED_SCALE
@@ -0,0 +1,62 @@
+import struct
+
+# Never used by messagepack, so compact packets can't be mistaken for a messagepack command
+COMPACT_MARKER = 0xC1
+
+PROTOCOL_MSGPACK = 1
+PROTOCOL_COMPACT = 2
+PROTOCOL_VERSIONS = (PROTOCOL_MSGPACK, PROTOCOL_COMPACT)
+
+COMPACT_MOVE = 1
+COMPACT_VIDEO_START = 2
+COMPACT_VIDEO_STOP = 3
+
+COMPACT_FLAG_ACK = 0x01
+
+# Marker, command ID, flags, then the command's fixed layout payload
+COMPACT_HEADER = struct.Struct('!BBB')
+COMPACT_PAYLOADS = {
+    COMPACT_MOVE: struct.Struct('!hh'),
+    COMPACT_VIDEO_START: struct.Struct(''),
+    COMPACT_VIDEO_STOP: struct.Struct('')
+}
+# Marker, command ID, success
+COMPACT_RESPONSE = struct.Struct('!BBB')
+
+# Motor speeds are sent as signed 16 bit fixed point
+COMPACT_SPEED_SCALE = 32767
+
+
+class CompactDecodingError(Exception):
+    pass
+
+
+# Precompiled packet layouts: full packet struct and expected size, per command ID
+COMPACT_PACKETS = {
+    command_id: struct.Struct(COMPACT_HEADER.format + payload.format.lstrip('!'))
+    for command_id, payload in COMPACT_PAYLOADS.items()
+}
+
+
+def is_compact(message) -> bool:
+    return isinstance(message, bytes) and len(message) >= COMPACT_HEADER.size and message[0] == COMPACT_MARKER
+
+
+def decode_compact(message: bytes) -> tuple:
+    """Returns the command ID, flags and the payload values of a compact packet"""
+    command_id = message[1]
+    packet = COMPACT_PACKETS.get(command_id)
+    if packet is None:
+        raise CompactDecodingError(f'Unknown command ID: {command_id}')
+    if len(message) != packet.size:
+        raise CompactDecodingError(f'Invalid packet size for command {command_id}: {len(message)}')
+    _, _, flags, *values = packet.unpack(message)
+    return command_id, flags, values
+
+
+def encode_compact(command_id: int, *values, ack: bool = False) -> bytes:
+    return COMPACT_PACKETS[command_id].pack(COMPACT_MARKER, command_id, COMPACT_FLAG_ACK if ack else 0, *values)
+
+
+def encode_compact_response(command_id: int, success: bool) -> bytes:
+    return COMPACT_RESPONSE.pack(COMPACT_MARKER, command_id, 1 if success else 0)
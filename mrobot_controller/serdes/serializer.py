@@ -1,5 +1,64 @@
+import base64
+import struct
 import msgpack
 
+VIDEO_TRANSPORTS = ('base64', 'msgpack', 'binary')
+# Full payload copies made while serializing and sending a video event with each transport. Every transport
+# pays one copy when websockets builds the frame, as Frame.serialize() writes the payload after the frame header
+VIDEO_TRANSPORT_COPIES = {
+    'base64': 3,
+    'msgpack': 2,
+    'binary': 1
+}
+
+VIDEO_HEADER = struct.Struct('!2sBBBxIHHQQQQ')
+VIDEO_HEADER_MAGIC = b'MV'
+VIDEO_HEADER_VERSION = 3
+VIDEO_HEADER_NO_TIME = 0xFFFFFFFFFFFFFFFF
+VIDEO_TIMESTAMPS = ('capture', 'pull', 'encoded')
+VIDEO_EVENT_IDS = {
+    'video_frame': 1,
+    'video_nal': 2,
+    'video_jpeg': 3
+}
+VIDEO_FLAG_KEYFRAME = 0x01
+VIDEO_FLAG_CONFIG = 0x02
+
 
 def serialize(deserialized_message: dict) -> bytes | None:
     return msgpack.packb(deserialized_message)
+
+
+def serialize_video_event(transport: str, event: str, payload, sequence: int = 0,
+                          width: int = 0, height: int = 0, pts: int | None = None, timestamps: dict = None,
+                          keyframe: bool = False, config: bool = False) -> list:
+    """
+    Serialize a video event into the fragments of a single websocket message.
+    The payload may be any bytes-like object; the binary transport references it without copying it here,
+    so it must stay valid until the message was sent (websockets only copies it while sending).
+    `timestamps` are the `time.monotonic_ns()` values of the frame's capture, pull and encoding, sent in microseconds.
+    """
+    timestamps = timestamps or {}
+    timestamps_us = {point: timestamps[point] // 1000 if timestamps.get(point) is not None else None
+                     for point in VIDEO_TIMESTAMPS}
+    if transport == 'binary':
+        flags = (VIDEO_FLAG_KEYFRAME if keyframe else 0) | (VIDEO_FLAG_CONFIG if config else 0)
+        header = VIDEO_HEADER.pack(VIDEO_HEADER_MAGIC, VIDEO_HEADER_VERSION,
+                                   VIDEO_EVENT_IDS[event], flags, sequence & 0xFFFFFFFF,
+                                   width, height, VIDEO_HEADER_NO_TIME if pts is None else pts,
+                                   *(VIDEO_HEADER_NO_TIME if timestamps_us[point] is None else timestamps_us[point]
+                                     for point in VIDEO_TIMESTAMPS))
+        return [header, payload]
+
+    message = {'event': event, 'sequence': sequence, 'width': width, 'height': height, 'pts': pts,
+               'timestamps': timestamps_us}
+    if event == 'video_nal':
+        message['keyframe'] = keyframe
+        message['config'] = config
+
+    if transport == 'msgpack':
+        message['payload'] = payload if isinstance(payload, (bytes, memoryview)) else memoryview(payload)
+    else:
+        message['payload'] = base64.b64encode(payload).decode('ascii')
+
+    return [serialize(message)]
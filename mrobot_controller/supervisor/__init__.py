@@ -0,0 +1 @@
+from .pipeline_supervisor import PipelineSupervisor
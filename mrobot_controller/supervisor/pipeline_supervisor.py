@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+
+# Seconds, from an in-place reset to a rebuild after a long backoff
+RECOVERY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Polling interval of the watchdog while waiting for the first frame after a recovery
+RECOVERY_POLL_INTERVAL = 0.02
+
+
+class PipelineSupervisor:
+    """
+    Keeps the video pipeline running, in process, while the websocket clients stay connected.
+
+    The pipeline fails on a GStreamer error, an end of stream, or a stall: no sample pulled from the appsink for
+    `stall-timeout` seconds while playing. The first recovery resets the pipeline in place, reusing its elements,
+    which is fast. When that fails, or the pipeline fails again within `stable-time` seconds, it's rebuilt from
+    scratch. Attempts are delayed by an exponential backoff, from `backoff-initial` up to `backoff-max` seconds.
+    Errors of the recording and RTP branches are reset by the pipeline itself, and never get here.
+
+    The recovery time is measured from the failure to the first sample pulled again (or to the pipeline being
+    restored, when it's not playing).
+    """
+    def __init__(self, video_streamer, create_video_streamer, config: dict, metrics=None,
+                 on_failure=None, on_recovered=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.video_streamer = video_streamer
+        # Builds and pre-rolls a new pipeline; runs in a worker thread
+        self.create_video_streamer = create_video_streamer
+        # Coroutine functions, called with the error, and with the recovered pipeline
+        self.on_failure = on_failure
+        self.on_recovered = on_recovered
+
+        self.stall_timeout = config['stall-timeout']
+        self.backoff_initial = config['backoff-initial']
+        self.backoff_max = config['backoff-max']
+        self.stable_time = config['stable-time']
+
+        self.attempts = 0
+        self.stalled = False
+        self.recovered_at = None
+        self.recovery_start = None
+        self.last_error = None
+        self.last_recovery_time = None
+
+        self.failure_count = None
+        self.recovery_count = None
+        self.recovery_time = None
+        if metrics is not None:
+            self.failure_count = metrics.counter('pipeline_failures_total', 'Video pipeline failures', ('cause',))
+            self.recovery_count = metrics.counter('pipeline_recoveries_total', 'Video pipeline recoveries',
+                                                  ('kind',))
+            self.recovery_time = metrics.histogram('pipeline_recovery_seconds',
+                                                   'Time from a pipeline failure to the first frame after it',
+                                                   buckets=RECOVERY_BUCKETS)
+
+    async def run(self):
+        """Runs the pipeline until it's stopped with stop(), recovering it from failures"""
+        while True:
+            self.stalled = False
+            watchdog = asyncio.create_task(self.watch(self.video_streamer))
+            try:
+                error = await self.video_streamer.start()
+            finally:
+                watchdog.cancel()
+            if error is None:
+                return
+
+            failed_at = time.monotonic()
+            cause = 'stall' if self.stalled else 'eos' if error == 'end of stream' else 'error'
+            self.last_error = error
+            self.logger.error(f'Video pipeline failed ({cause}): {error}')
+            if self.failure_count is not None:
+                self.failure_count.labels(cause).inc()
+            if self.on_failure is not None:
+                await self.on_failure(error)
+            await self.recover(failed_at)
+
+    async def recover(self, failed_at: float):
+        if self.recovered_at is None or failed_at - self.recovered_at > self.stable_time:
+            self.attempts = 0
+
+        # Taken once, as a failed attempt may leave the pipeline in any state
+        state = self.video_streamer.get_state()
+        # Stopped off the loop, which keeps driving the motors while the streaming threads wind down
+        await asyncio.to_thread(self.video_streamer.stop)
+        while True:
+            delay = min(self.backoff_initial * 2 ** self.attempts, self.backoff_max)
+            kind = 'reset' if self.attempts == 0 else 'rebuild'
+            self.attempts += 1
+            self.logger.info(f'Video pipeline {kind} in {delay:.2f}s (attempt {self.attempts})')
+            await asyncio.sleep(delay)
+            try:
+                if kind == 'reset':
+                    await asyncio.to_thread(self.video_streamer.restart, state)
+                else:
+                    await asyncio.to_thread(self.rebuild, state)
+                break
+            except Exception as e:
+                self.logger.error(f'Video pipeline {kind} failed: {e}')
+
+        self.recovered_at = time.monotonic()
+        self.recovery_start = failed_at
+        self.logger.info(f'Video pipeline recovered ({kind}) after {self.recovered_at - failed_at:.3f}s')
+        if self.recovery_count is not None:
+            self.recovery_count.labels(kind).inc()
+        if self.on_recovered is not None:
+            await self.on_recovered(self.video_streamer)
+
+    def rebuild(self, state: dict):
+        # A failed reset may have left the old pipeline holding the device
+        self.video_streamer.stop()
+        video_streamer = self.create_video_streamer()
+        video_streamer.restore_state(state)
+        self.video_streamer = video_streamer
+
+    async def watch(self, video_streamer):
+        """Fails the pipeline when no sample was pulled for `stall_timeout` seconds while playing"""
+        samples = video_streamer.samples_pulled
+        last_sample = time.monotonic()
+        while True:
+            interval = self.stall_timeout / 4 if self.recovery_start is None else RECOVERY_POLL_INTERVAL
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            producing = video_streamer.playing or video_streamer.keep_playing
+            if video_streamer.samples_pulled != samples or not producing:
+                if self.recovery_start is not None:
+                    self.record_recovery(now)
+                samples = video_streamer.samples_pulled
+                last_sample = now
+            elif now - last_sample > self.stall_timeout:
+                self.stalled = True
+                video_streamer.fail(f'no frame for {now - last_sample:.1f}s')
+                return
+
+    def record_recovery(self, now: float):
+        self.last_recovery_time = now - self.recovery_start
+        self.recovery_start = None
+        if self.recovery_time is not None:
+            self.recovery_time.observe(self.last_recovery_time)
+
+    def get_stats(self) -> dict:
+        return {
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'last_recovery_time': self.last_recovery_time
+        }
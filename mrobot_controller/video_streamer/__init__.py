@@ -1 +1,11 @@
-from .video_streamer import VideoStreamer, VideoFrameHandler
+from .video_frame import VideoFrame, VideoFrameHandler
+from .h264 import extract_parameter_sets
+from .recording import dump_segments
+
+
+def __getattr__(name):
+    # GStreamer takes long to import, so the pipeline module is only imported once it's needed
+    if name in ('VideoStreamer', 'VIDEO_MODES', 'VIDEO_FAULTS'):
+        from . import video_streamer
+        return getattr(video_streamer, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
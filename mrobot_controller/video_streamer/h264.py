@@ -0,0 +1,35 @@
+NAL_TYPE_IDR = 5
+NAL_TYPE_SPS = 7
+NAL_TYPE_PPS = 8
+
+START_CODE = b'\x00\x00\x00\x01'
+SHORT_START_CODE = b'\x00\x00\x01'
+
+
+def split_nal_units(data) -> list:
+    """Split an Annex-B byte-stream access unit into NAL units (without start codes)"""
+    data = bytes(data)
+    units = []
+    position = data.find(SHORT_START_CODE)
+    while position != -1:
+        start = position + len(SHORT_START_CODE)
+        position = data.find(SHORT_START_CODE, start)
+        end = len(data) if position == -1 else position
+        # A 4-byte start code leaves a leading zero on the previous unit
+        if position != -1 and data[end - 1] == 0:
+            end -= 1
+        if end > start:
+            units.append(data[start:end])
+    return units
+
+
+def nal_unit_type(nal_unit: bytes) -> int:
+    return nal_unit[0] & 0x1F if nal_unit else -1
+
+
+def extract_parameter_sets(data) -> bytes | None:
+    """Return the SPS/PPS NAL units of an access unit as a byte-stream, or None if absent"""
+    parameter_sets = [nal for nal in split_nal_units(data) if nal_unit_type(nal) in (NAL_TYPE_SPS, NAL_TYPE_PPS)]
+    if not parameter_sets:
+        return None
+    return b''.join(START_CODE + nal for nal in parameter_sets)
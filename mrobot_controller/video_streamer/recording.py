@@ -0,0 +1,51 @@
+import os
+import shutil
+import time
+
+SEGMENT_PREFIX = 'segment'
+# MPEG-TS segments stay playable up to the last written packet, even after a power loss
+SEGMENT_EXTENSION = '.ts'
+
+
+def segment_location(directory: str) -> str:
+    """splitmuxsink location pattern of the recording segments"""
+    return os.path.join(directory, f'{SEGMENT_PREFIX}%05d{SEGMENT_EXTENSION}')
+
+
+def list_segments(directory: str) -> list:
+    """Recorded segments as (path, size) tuples, oldest first"""
+    segments = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not (entry.name.startswith(SEGMENT_PREFIX) and entry.name.endswith(SEGMENT_EXTENSION)):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed by the ring in the meantime
+                    continue
+                segments.append((stat.st_mtime, entry.path, stat.st_size))
+    except FileNotFoundError:
+        return []
+    return [(path, size) for _, path, size in sorted(segments)]
+
+
+def dump_segments(directory: str, dump_directory: str) -> tuple:
+    """
+    Move the recorded segments into a new timestamped directory under `dump_directory`, so the ring doesn't
+    overwrite them. On the same filesystem this is a rename, with no data written to the flash storage.
+    Returns the dump path and the dumped files.
+    """
+    destination = os.path.join(dump_directory, time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(destination, exist_ok=True)
+    dumped = []
+    for index, (segment, _) in enumerate(list_segments(directory)):
+        # Ring file names are reused, so they're renamed by age to keep their order
+        target = os.path.join(destination, f'{index:05d}-{os.path.basename(segment)}')
+        try:
+            shutil.move(segment, target)
+        except FileNotFoundError:
+            continue
+        dumped.append(target)
+    return destination, dumped
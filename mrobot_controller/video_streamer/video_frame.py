@@ -0,0 +1,73 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+
+class VideoFrame:
+    """
+    A single frame, handed over from the GStreamer streaming thread to the send path.
+    Carries the frame metadata of the negotiated caps (width, height, format and row stride for raw frames),
+    and the buffer's presentation timestamp in nanoseconds, if any.
+    `timestamps` holds `time.monotonic_ns()` values of the points the frame passed, starting with
+    `capture` (if known) and `pull`.
+
+    The frame holds a reference to the sample and keeps its buffer mapped, so `data` is a
+    view of the buffer memory. The frame must be released once the last consumer is done
+    with `data` (usually when the websocket send finished).
+    """
+    def __init__(self, sample, buffer, map_info, keyframe: bool, caps_info: dict, pts: int | None = None,
+                 timestamps: dict = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.sample = sample
+        self.buffer = buffer
+        self.map_info = map_info
+        self.keyframe = keyframe
+        self.width = caps_info['width']
+        self.height = caps_info['height']
+        self.format = caps_info['format']
+        self.stride = caps_info['stride']
+        self.pts = pts
+        self.timestamps = timestamps if timestamps is not None else {}
+        self.data = memoryview(map_info.data)
+        self.size = self.data.nbytes
+        # Without the GStreamer python overrides, the mapped data is handed over as a bytes copy
+        self.copies = 0 if isinstance(map_info.data, memoryview) else 1
+        self.allocations = self.copies
+        self.lock = threading.Lock()
+        self.references = 1
+
+    def count_copy(self, copies: int = 1):
+        self.copies += copies
+        self.allocations += copies
+
+    def count_allocation(self, allocations: int = 1):
+        self.allocations += allocations
+
+    def acquire(self):
+        with self.lock:
+            self.references += 1
+        return self
+
+    def release(self, *_):
+        with self.lock:
+            self.references -= 1
+            if self.references > 0 or self.buffer is None:
+                return
+            buffer, map_info = self.buffer, self.map_info
+            self.buffer = self.map_info = self.sample = None
+
+        try:
+            self.data.release()
+        except BufferError as e:
+            # A consumer still holds a buffer of the data; unmapped anyway, as the mapping would otherwise leak
+            self.logger.warning('Video frame data still in use at release: %s', e)
+        try:
+            buffer.unmap(map_info)
+        except Exception as e:
+            self.logger.warning('Failed to unmap video buffer: %s', e)
+
+
+class VideoFrameHandler(ABC):
+    @abstractmethod
+    async def handle_frame(self, frame: VideoFrame):
+        pass
@@ -1,14 +1,23 @@
+import asyncio
 import gi
 import logging
+import os
+import time
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst, GLib
-from abc import ABC, abstractmethod
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo, GLib
+from .video_frame import VideoFrame, VideoFrameHandler
+from .recording import segment_location, list_segments
+from ..log_utils import RateLimitedLogger
 
-
-class VideoFrameHandler(ABC):
-    @abstractmethod
-    async def handle_frame(self, frame, size):
-        pass
+VIDEO_MODES = ('png', 'jpeg', 'h264')
+# Faults the test source can inject: a source error, an end of stream, a source which stops producing buffers, and
+# an error in the recording branch
+VIDEO_FAULTS = ('error', 'eos', 'stall', 'record-error')
+# Hardware encoders first, falling back to the software encoder
+JPEG_ENCODERS = ('v4l2jpegenc', 'omxmjpegenc', 'jpegenc')
+# videorate's max-rate default, i.e. the source frame rate
+UNLIMITED_FRAMERATE = 2147483647
 
 
 class VideoStreamer:
@@ -17,11 +26,60 @@ class VideoStreamer:
                  device: str,
                  width: int,
                  height: int,
-                 test: bool = False):
+                 test: bool = False,
+                 mode: str = 'png',
+                 jpeg_quality: int = 85,
+                 keyframe_interval: int = 30,
+                 recording: dict = None,
+                 rtp: dict = None,
+                 metrics=None,
+                 keep_playing: bool = False):
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.frame_logger = RateLimitedLogger(self.logger)
+        if mode not in VIDEO_MODES:
+            raise Exception(f'Unsupported video mode: {mode}')
+
+        self.mode = mode
+        self.test = test
+        self.jpeg_quality = jpeg_quality
+        self.keyframe_interval = keyframe_interval
+        # V4L2 controls of the camera, set together as they share the extra-controls property
+        self.source_controls = {}
+        self.width = width
+        self.height = height
+        self.frame_size = (width, height)
+        self.framerate = 0
+        self.scale = 1.0
+        # Region of interest of the source frame, as [x, y, width, height]
+        self.roi = None
+        self.caps = None
+        self.caps_info = None
         self.pipeline = None
         self.elements = {}
+        # Recording branch, fed by a tee after the parser. None when recording is disabled
+        self.recording_config = recording
+        self.record_elements = None
+        self.recording = False
+        # RTP/UDP branch, with the (host, port) destinations currently sent to
+        self.rtp_config = rtp
+        self.rtp_elements = None
+        self.rtp_destinations = set()
+        self.playing = False
+        # Keeps the pipeline playing while no client gets video, for the consumers of every frame (shared memory).
+        # `playing` then only tells whether frames are sent to the clients
+        self.keep_playing = keep_playing
+        # Samples pulled from the appsink, watched for stalls
+        self.samples_pulled = 0
+        # Pad probe of an injected stall
+        self.stall_probe = None
         self.bus = None
+        self.bus_messages = None
+        self.branch_resets = None
+        if metrics is not None:
+            self.bus_messages = metrics.counter('gstreamer_bus_messages_total', 'GStreamer bus warnings and errors',
+                                                ('type',))
+            self.branch_resets = metrics.counter('pipeline_recoveries_total', 'Video pipeline recoveries',
+                                                 ('kind',)).labels('branch')
 
         # Initialize GStreamer
         Gst.init(None)
@@ -30,11 +88,21 @@ class VideoStreamer:
         self.video_frame_handler = video_frame_handler
         self.create_elements(device, width, height, test)
         self.create_pipeline()
-        self.add_elements()
-        self.link_elements()
+        self.add_elements(self.elements)
+        self.link_elements(self.elements)
+        for branch in (self.record_elements, self.rtp_elements):
+            if branch is not None:
+                self.add_elements(branch)
+                self.link_elements(branch)
+                self.link_branch(branch)
         self.create_bus()
 
-        self.loop = GLib.MainLoop()
+        # Bus messages are dispatched on the asyncio loop running start()
+        self.event_loop = None
+        self.bus_fd = None
+        self.stopped = None
+        # Why the pipeline stopped on its own (error or end of stream)
+        self.error = None
 
     def create_pipeline(self):
         self.pipeline = Gst.Pipeline.new('video-stream')
@@ -54,53 +122,168 @@ class VideoStreamer:
             self.create_test_source(width, height)
 
         self.elements['h264parse'] = self.gst_element_create('h264parse', 'parser')
-        self.elements['h264decoder'] = self.gst_element_create('avdec_h264', 'decoder')
+        if self.recording_config is not None or self.rtp_config is not None:
+            # The encoded stream is split between the live branch and the recording and RTP branches.
+            # The live branch gets a valve, so it can be stopped while the pipeline keeps running
+            self.elements['tee'] = self.gst_element_create('tee', 'tee')
+            self.elements['live_valve'] = self.gst_element_create('valve', 'live_valve')
+        if self.recording_config is not None:
+            self.create_recording_branch()
+        if self.rtp_config is not None:
+            self.create_rtp_branch()
 
-        self.elements['rgb_convert'] = self.gst_element_create('videoconvert', 'rgbconvert')
-        self.elements['rgb_capsfilter'] = self.gst_element_create('capsfilter', 'rgb_capsfilter')
-        self.gst_element_set_caps(self.elements['rgb_capsfilter'], f'video/x-raw,format=RGB,width={width},height={height}')
+        if self.mode == 'h264':
+            self.create_h264_output()
+        else:
+            self.create_raw_output(width, height)
+            if self.mode == 'jpeg':
+                self.create_jpeg_encoder()
 
         self.create_sink()
 
+    def create_h264_output(self):
+        # Emit SPS/PPS with every IDR frame, so any client can start decoding on a keyframe
+        self.elements['h264parse'].set_property('config-interval', -1)
+        self.elements['h264_capsfilter'] = self.gst_element_create('capsfilter', 'h264_capsfilter')
+        self.gst_element_set_caps(self.elements['h264_capsfilter'], 'video/x-h264,stream-format=byte-stream,alignment=au')
+
+    def create_raw_output(self, width: int, height: int):
+        self.elements['h264decoder'] = self.gst_element_create('avdec_h264', 'decoder')
+
+        # Crop, framerate and resolution stages, adjusted at runtime by set_quality(). Cropping and dropping
+        # frames first means the following stages, the encoder and the network only handle what is sent
+        self.elements['videocrop'] = self.gst_element_create('videocrop', 'videocrop')
+        self.elements['videorate'] = self.gst_element_create('videorate', 'videorate', {'drop-only': True})
+        self.elements['videoscale'] = self.gst_element_create('videoscale', 'videoscale')
+
+        self.elements['raw_convert'] = self.gst_element_create('videoconvert', 'rawconvert')
+        self.elements['raw_capsfilter'] = self.gst_element_create('capsfilter', 'raw_capsfilter')
+        self.gst_element_set_caps(self.elements['raw_capsfilter'], self.raw_caps(width, height))
+
+    def raw_caps(self, width: int, height: int) -> str:
+        # PNG frames are encoded from RGB, while the JPEG encoder negotiates its preferred format
+        if self.mode == 'png':
+            return f'video/x-raw,format=RGB,width={width},height={height}'
+        return f'video/x-raw,width={width},height={height}'
+
+    def create_jpeg_encoder(self):
+        factory_name = next((name for name in JPEG_ENCODERS if Gst.ElementFactory.find(name)), None)
+        if factory_name is None:
+            raise Exception('No JPEG encoder available')
+        self.logger.info(f'Using {factory_name} for JPEG encoding')
+        self.elements['jpeg-encoder'] = self.gst_element_create(factory_name, 'jpeg-encoder')
+        self.set_jpeg_quality(self.jpeg_quality)
+
+    def set_jpeg_quality(self, quality: int):
+        encoder = self.elements['jpeg-encoder']
+        if encoder.find_property('quality') is not None:
+            encoder.set_property('quality', int(quality))
+        else:
+            # V4L2 encoders take the quality as a device control
+            controls = Gst.Structure.new_from_string(f'controls,compression_quality={int(quality)}')
+            encoder.set_property('extra-controls', controls)
+        self.jpeg_quality = quality
+
     def create_video_source(self, device: str, width: int, height: int):
         self.logger.debug('Creating V4L source')
         self.elements['source'] = self.gst_element_create('v4l2src', 'source',
                                                           {'device': device})
         self.elements['capsfilter'] = self.gst_element_create('capsfilter', 'source-capsfilter')
         self.gst_element_set_caps(self.elements['capsfilter'], f'video/x-h264,width={width},height={height}')
+        # A short keyframe interval lets clients and RTP receivers recover quickly from lost frames
+        self.set_source_control('h264_i_frame_period', self.keyframe_interval)
+
+    def set_source_control(self, name: str, value: int):
+        self.source_controls[name] = int(value)
+        controls = ','.join(f'{key}={value}' for key, value in self.source_controls.items())
+        self.elements['source'].set_property('extra-controls', Gst.Structure.new_from_string(f'controls,{controls}'))
 
     def create_test_source(self, width: int, height: int):
         self.logger.debug('Creating test source')
         self.elements['source'] = self.gst_element_create('videotestsrc', 'source')
         self.elements['capsfilter'] = self.gst_element_create('capsfilter', 'source-capsfilter')
         self.gst_element_set_caps(self.elements['capsfilter'], f'video/x-raw,width={width},height={height}')
-        self.elements['source-encoder'] = self.gst_element_create('x264enc', 'test-source-encoding')
+        self.elements['source-encoder'] = self.gst_element_create('x264enc', 'test-source-encoding',
+                                                                  {'key-int-max': self.keyframe_interval})
+        Gst.util_set_object_arg(self.elements['source-encoder'], 'tune', 'zerolatency')
+
+    def create_recording_branch(self):
+        config = self.recording_config
+        os.makedirs(config['directory'], exist_ok=True)
+
+        # A leaky queue decouples the disk from the live branch: when the disk falls behind,
+        # the oldest queued data is dropped, and the live branch is never blocked
+        queue_time = int(config['queue-time'] * Gst.SECOND)
+        self.record_elements = {
+            'record_queue': self.gst_element_create('queue', 'record_queue', {'max-size-buffers': 0,
+                                                                             'max-size-bytes': 0,
+                                                                             'max-size-time': queue_time}),
+            'record_valve': self.gst_element_create('valve', 'record_valve', {'drop': True}),
+            'record_sink': self.gst_element_create('splitmuxsink', 'record_sink', {
+                'location': segment_location(config['directory']),
+                'max-size-time': int(config['segment-duration'] * Gst.SECOND),
+                'max-files': config['max-files'],
+                'muxer-factory': 'mpegtsmux',
+                'send-keyframe-requests': True
+            })
+        }
+        Gst.util_set_object_arg(self.record_elements['record_queue'], 'leaky', 'downstream')
+        # Large sequential writes, which suit flash storage best
+        self.record_elements['record_sink'].set_property('sink', self.gst_element_create(
+            'filesink', 'record_filesink', {'buffer-size': config['write-buffer-size'], 'async': False}))
+        Gst.util_set_object_arg(self.record_elements['record_sink'].get_property('sink'), 'buffer-mode', 'full')
+
+    def create_rtp_branch(self):
+        config = self.rtp_config
+        # Sending never blocks on the network, but the queue still keeps the payloader off the streaming thread.
+        # It only holds a few frames, as late video is useless for driving
+        self.rtp_elements = {
+            'rtp_queue': self.gst_element_create('queue', 'rtp_queue', {'max-size-buffers': 5,
+                                                                       'max-size-bytes': 0,
+                                                                       'max-size-time': 0}),
+            'rtp_payloader': self.gst_element_create('rtph264pay', 'rtp_payloader', {
+                'mtu': config['mtu'],
+                # SPS/PPS with every IDR frame, so a receiver can start decoding on any keyframe
+                'config-interval': -1,
+                'pt': 96
+            }),
+            'rtp_sink': self.gst_element_create('multiudpsink', 'rtp_sink', {'sync': False, 'async': False})
+        }
+        Gst.util_set_object_arg(self.rtp_elements['rtp_queue'], 'leaky', 'downstream')
+
+    def link_branch(self, branch: dict):
+        head = next(iter(branch.values()))
+        if not self.elements['tee'].link(head):
+            raise Exception(f'Failed to link {head.get_name()} to the tee')
+        self.logger.info(f'Branch {head.get_name()} linked to the tee')
 
     def create_sink(self):
-        self.elements['sink'] = self.gst_element_create('appsink', 'sink')
+        # Keep only the newest frame; a frame that can't be consumed in time is dropped, not queued
+        self.elements['sink'] = self.gst_element_create('appsink', 'sink',
+                                                        {'max-buffers': 1, 'drop': True})
         self.elements['sink'].set_property('emit-signals', True)
         self.elements['sink'].connect('new-sample', VideoStreamer.on_new_sample_callback, self)
 
-    def add_elements(self):
+    def add_elements(self, elements: dict):
         self.logger.debug('Adding elements to pipeline')
-        keys_iter = iter(self.elements)
+        keys_iter = iter(elements)
         try:
             while True:
                 element_key = next(keys_iter)
-                element = self.elements[element_key]
+                element = elements[element_key]
                 self.logger.debug(f'- Adding {element.get_name()} to pipeline')
                 self.pipeline.add(element)
         except StopIteration:
             pass
 
-    def link_elements(self):
+    def link_elements(self, elements: dict):
         self.logger.debug('Linking elements')
-        keys_iter = iter(self.elements)
-        prev = self.elements[next(keys_iter)]
+        keys_iter = iter(elements)
+        prev = elements[next(keys_iter)]
         try:
             while True:
                 element_key = next(keys_iter)
-                current = self.elements[element_key]
+                current = elements[element_key]
                 self.logger.debug(f' - {prev.get_name()} -> {current.get_name()}')
                 if not prev.link(current):
                     msg = f'Failed to link {prev.get_name()} to {current.get_name()}'
@@ -111,9 +294,8 @@ class VideoStreamer:
             pass
 
     def create_bus(self):
+        # Messages are queued on the bus until start() dispatches them
         self.bus = self.pipeline.get_bus()
-        self.bus.add_signal_watch()
-        self.bus.connect('message', self.on_message)
         self.logger.debug('Bus connected to pipeline')
 
     def gst_element_create(self, element_type: str, element_name: str, props: dict = None):
@@ -141,37 +323,201 @@ class VideoStreamer:
 
     def handle_sample(self):
         sample = self.elements['sink'].emit('pull-sample')
+        pull_time = time.monotonic_ns()
         if not sample:
             return Gst.FlowReturn.ERROR
+        self.samples_pulled += 1
 
+        buffer = sample.get_buffer()
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            self.frame_logger.warning('Failed to map video buffer')
+            return Gst.FlowReturn.OK
+
+        # The frame owns the mapping from here on, and unmaps once all consumers released it
+        keyframe = not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        pts = buffer.pts if buffer.pts != Gst.CLOCK_TIME_NONE else None
+        timestamps = {'capture': self.get_capture_time(sample, pts, pull_time), 'pull': pull_time}
+        frame = VideoFrame(sample, buffer, map_info, keyframe, self.get_caps_info(sample.get_caps()), pts,
+                           timestamps)
         try:
-            buffer = sample.get_buffer()
-            success, map_info = buffer.map(Gst.MapFlags.READ)
-            if success:
-                self.logger.debug('Passing new frame')
-                raw_data = map_info.data
-                self.video_frame_handler.handle_frame(raw_data, len(raw_data))
+            self.video_frame_handler.handle_frame(frame)
         except Exception as e:
-            self.logger.warning(f'Error while reading video buffer: {e}')
+            self.frame_logger.warning('Error while handling video frame: %s', e)
         finally:
-            buffer.unmap(map_info)
+            frame.release()
 
         return Gst.FlowReturn.OK
 
+    def get_capture_time(self, sample, pts: int | None, pull_time: int) -> int | None:
+        """Map the buffer PTS through the pipeline clock to a `time.monotonic_ns()` capture time"""
+        clock = self.pipeline.get_clock()
+        if pts is None or clock is None:
+            return None
+
+        running_time = sample.get_segment().to_running_time(Gst.Format.TIME, pts)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return None
+
+        # Age of the buffer, as the running time of the pipeline now minus its running time at capture
+        age = clock.get_time() - self.pipeline.get_base_time() - running_time
+        return pull_time - age
+
+    def get_caps_info(self, caps) -> dict:
+        """Frame metadata of the negotiated caps. Caps rarely change, so they are parsed only when they do"""
+        if self.caps is not None and caps is not None and caps.is_equal(self.caps):
+            return self.caps_info
+
+        structure = caps.get_structure(0)
+        if structure.get_name() == 'video/x-raw':
+            video_info = GstVideo.VideoInfo.new_from_caps(caps)
+            caps_info = {
+                'width': video_info.width,
+                'height': video_info.height,
+                'format': video_info.finfo.name,
+                'stride': video_info.stride[0]
+            }
+        else:
+            _, width = structure.get_int('width')
+            _, height = structure.get_int('height')
+            caps_info = {
+                'width': width,
+                'height': height,
+                'format': structure.get_name().split('/')[-1].removeprefix('x-'),
+                'stride': 0
+            }
+
+        self.logger.info(f'Negotiated caps: {caps_info}')
+        self.caps = caps
+        self.caps_info = caps_info
+        return caps_info
+
+    def set_quality(self, quality: dict):
+        """
+        Apply a quality rung or an output configuration on the running pipeline, without tearing it down.
+        Supported keys: `bitrate` (kbit/s), `scale` (of the region of interest, or the configured resolution),
+        `framerate` (frames per second, `0` for the source rate), `roi` (`[x, y, width, height]` of the configured
+        resolution, or None for the whole frame) and `jpeg-quality`.
+        Keys which don't apply to the current pipeline are ignored.
+        """
+        # Validated first, so an invalid region doesn't leave the other keys half applied
+        if 'roi' in quality and 'videocrop' in self.elements:
+            self.set_roi(quality['roi'])
+
+        if 'bitrate' in quality:
+            self.set_bitrate(quality['bitrate'])
+
+        if 'framerate' in quality and 'videorate' in self.elements:
+            framerate = int(quality['framerate'])
+            self.elements['videorate'].set_property('max-rate', framerate if framerate > 0 else UNLIMITED_FRAMERATE)
+            self.framerate = framerate
+
+        if 'scale' in quality:
+            self.scale = quality['scale']
+
+        if ('scale' in quality or 'roi' in quality) and 'raw_capsfilter' in self.elements:
+            self.update_frame_size()
+
+        if 'jpeg-quality' in quality and 'jpeg-encoder' in self.elements:
+            self.set_jpeg_quality(quality['jpeg-quality'])
+
+    def set_roi(self, roi: list | None):
+        if roi is None:
+            x, y, width, height = 0, 0, self.width, self.height
+        else:
+            x, y, width, height = (int(value) for value in roi)
+            if x < 0 or y < 0 or width < 2 or height < 2 or x + width > self.width or y + height > self.height:
+                raise ValueError(f'Region of interest {roi} is out of the {self.width}x{self.height} frame')
+
+        crop = self.elements['videocrop']
+        crop.set_property('left', x)
+        crop.set_property('top', y)
+        crop.set_property('right', self.width - x - width)
+        crop.set_property('bottom', self.height - y - height)
+        self.roi = None if roi is None else [x, y, width, height]
+
+    def update_frame_size(self):
+        _, _, roi_width, roi_height = self.roi or (0, 0, self.width, self.height)
+        # Keep dimensions even, as required by most raw video formats
+        width = max(2, int(roi_width * self.scale) & ~1)
+        height = max(2, int(roi_height * self.scale) & ~1)
+        if (width, height) != self.frame_size:
+            self.gst_element_set_caps(self.elements['raw_capsfilter'], self.raw_caps(width, height))
+            self.frame_size = (width, height)
+
+    def get_output_config(self) -> dict:
+        return {
+            'framerate': self.framerate,
+            'scale': self.scale,
+            'roi': self.roi,
+            'width': self.frame_size[0],
+            'height': self.frame_size[1]
+        }
+
+    def set_bitrate(self, bitrate: int):
+        if 'source-encoder' in self.elements:
+            self.elements['source-encoder'].set_property('bitrate', int(bitrate))
+        else:
+            self.set_source_control('video_bitrate', int(bitrate) * 1000)
+
+    def add_rtp_destination(self, host: str, port: int):
+        if self.rtp_elements is None:
+            raise Exception('RTP output is not enabled')
+        if (host, port) in self.rtp_destinations:
+            return
+        if len(self.rtp_destinations) >= self.rtp_config['max-destinations']:
+            raise Exception(f'Too many RTP destinations (max {self.rtp_config["max-destinations"]})')
+        self.rtp_elements['rtp_sink'].emit('add', host, port)
+        self.rtp_destinations.add((host, port))
+        self.logger.info(f'Sending RTP to {host}:{port}')
+        # Receivers can only start decoding on a keyframe
+        self.request_keyframe()
+
+    def remove_rtp_destination(self, host: str, port: int):
+        if (host, port) not in self.rtp_destinations:
+            return
+        self.rtp_elements['rtp_sink'].emit('remove', host, port)
+        self.rtp_destinations.discard((host, port))
+        self.logger.info(f'Stopped sending RTP to {host}:{port}')
+
+    def clear_rtp_destinations(self):
+        if self.rtp_elements is None or not self.rtp_destinations:
+            return
+        self.rtp_elements['rtp_sink'].emit('clear')
+        self.rtp_destinations.clear()
+        self.logger.info('Stopped sending RTP')
+
+    def get_rtp_destinations(self) -> list:
+        return [f'{host}:{port}' for host, port in sorted(self.rtp_destinations)]
+
+    def request_keyframe(self):
+        # Ask the upstream encoder for an IDR frame (with SPS/PPS), e.g. when a new client joins
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        if not self.elements['sink'].send_event(event):
+            self.logger.debug('Key frame request was not handled upstream')
+
     def on_message(self, bus, message):
         res = True
         msg_type = message.type
+        if self.bus_messages is not None and msg_type in (Gst.MessageType.ERROR, Gst.MessageType.WARNING):
+            self.bus_messages.labels('error' if msg_type == Gst.MessageType.ERROR else 'warning').inc()
         if msg_type == Gst.MessageType.ERROR:
             err, debug = message.parse_error()
             self.logger.error(f'Error: {err}, {debug}')
-            self.stop()
-            res = False
+            branch = self.find_branch(message.src)
+            if branch is not None:
+                # The live path is fine, so only the failing branch is reset
+                self.reset_branch(branch)
+            else:
+                self.fail(err.message)
+                res = False
         elif msg_type == Gst.MessageType.WARNING:
             err, debug = message.parse_warning()
             self.logger.warning(f'Warning: {err}, {debug}')
         elif msg_type == Gst.MessageType.EOS:
             self.logger.info('End-Of-Stream reached')
-            self.stop()
+            # A live source only ends when it's gone, e.g. an unplugged camera
+            self.fail('end of stream')
             res = False
         elif msg_type == Gst.MessageType.STATE_CHANGED:
             if isinstance(message.src, Gst.Pipeline):
@@ -197,22 +543,207 @@ class VideoStreamer:
 
         return res
 
-    async def start(self):
-        # Start playing the pipeline
-        self.pause()
+    def preroll(self, timeout: float = 5.0) -> bool:
+        """
+        Bring the pipeline to PAUSED ahead of the first video_start, opening the device and negotiating
+        what can be negotiated. Live sources don't pre-roll, and only produce data once playing.
+        """
+        result = self.pipeline.set_state(Gst.State.PAUSED)
+        if result == Gst.StateChangeReturn.ASYNC:
+            result, _, _ = self.pipeline.get_state(int(timeout * Gst.SECOND))
+        if result == Gst.StateChangeReturn.FAILURE:
+            raise Exception('Failed to pre-roll the pipeline')
+        self.logger.info(f'Pipeline pre-rolled: {result.value_nick}')
+        return result in (Gst.StateChangeReturn.SUCCESS, Gst.StateChangeReturn.NO_PREROLL)
+
+    async def start(self) -> str | None:
+        """
+        Dispatches the bus messages on the running loop until the pipeline stops.
+        Returns why the pipeline stopped on its own, or None if it was stopped with stop().
+        """
+        self.event_loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        # The bus makes this fd readable while messages are queued, whichever thread posted them
+        self.bus_fd = self.bus.get_pollfd().fd
+        self.event_loop.add_reader(self.bus_fd, self.dispatch_bus_messages)
+        # Messages posted while the pipeline was built and pre-rolled
+        self.dispatch_bus_messages()
         self.logger.info('Pipeline ready')
-        self.loop = self.loop.run()
+        if self.keep_playing:
+            # Started once the handler has this pipeline, as it then gets frames with no client
+            self.logger.info('Pipeline state: PLAYING, until stopped')
+            self.pipeline.set_state(Gst.State.PLAYING)
+        await self.stopped.wait()
+        return self.error
+
+    def dispatch_bus_messages(self):
+        while self.bus_fd is not None:
+            message = self.bus.pop()
+            if message is None:
+                break
+            self.on_message(self.bus, message)
+
+    def detach_bus(self):
+        if self.bus_fd is not None:
+            self.event_loop.remove_reader(self.bus_fd)
+            self.bus_fd = None
+        self.stopped.set()
 
     def play(self):
         self.logger.info('Pipeline state: PLAYING')
+        self.playing = True
         self.pipeline.set_state(Gst.State.PLAYING)
+        if 'live_valve' in self.elements and self.elements['live_valve'].get_property('drop'):
+            self.elements['live_valve'].set_property('drop', False)
+            # The live branch was stopped while recording, and has to resume on a keyframe
+            self.request_keyframe()
 
     def pause(self):
+        self.playing = False
+        if self.keep_playing:
+            self.logger.info('Client output stopped, pipeline still playing')
+            return
+        if self.recording:
+            # Keep the pipeline running for the recording branch, and only stop the live branch
+            self.logger.info('Live branch stopped, still recording')
+            self.elements['live_valve'].set_property('drop', True)
+            return
         self.logger.info('Pipeline state: PAUSED')
         self.pipeline.set_state(Gst.State.PAUSED)
 
+    def find_branch(self, source) -> dict | None:
+        """The tee branch `source` (an element, or a child of one) belongs to, or None for the main path"""
+        for branch in (self.record_elements, self.rtp_elements):
+            if branch is None or source is None:
+                continue
+            for element in branch.values():
+                if source == element or source.has_as_ancestor(element):
+                    return branch
+        return None
+
+    def reset_branch(self, branch: dict):
+        """Bring a tee branch back from an error, while the rest of the pipeline keeps running"""
+        head = next(iter(branch.values()))
+        self.logger.warning(f'Resetting branch {head.get_name()}')
+        if branch is self.record_elements:
+            # A failing recording (e.g. a full disk) would fail again; it's restarted by a record_start command
+            self.stop_recording()
+        # Buffers pushed into the branch while it's reset are dropped, rather than failing the tee
+        tee_pad = head.get_static_pad('sink').get_peer()
+        probe = tee_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                                  lambda *_: Gst.PadProbeReturn.DROP)
+        for element in reversed(list(branch.values())):
+            element.set_state(Gst.State.NULL)
+        for element in branch.values():
+            element.sync_state_with_parent()
+        tee_pad.remove_probe(probe)
+        if self.branch_resets is not None:
+            self.branch_resets.inc()
+
+    def inject_fault(self, fault: str):
+        """Simulate a failure of the test source, to exercise the recovery"""
+        if not self.test:
+            raise Exception('Faults can only be injected into the test source')
+        if fault not in VIDEO_FAULTS:
+            raise Exception(f'Unsupported fault: {fault}')
+        self.logger.warning(f'Injecting fault: {fault}')
+        if fault == 'stall':
+            if self.stall_probe is None:
+                pad = self.elements['source'].get_static_pad('src')
+                self.stall_probe = pad.add_probe(Gst.PadProbeType.BUFFER, lambda *_: Gst.PadProbeReturn.DROP)
+            return
+        if fault == 'eos':
+            self.bus.post(Gst.Message.new_eos(self.pipeline))
+            return
+        if fault == 'record-error':
+            if self.record_elements is None:
+                raise Exception('Recording is not enabled')
+            source = self.record_elements['record_sink']
+        else:
+            source = self.elements['source']
+        error = GLib.Error.new_literal(Gst.StreamError.quark(), 'Injected fault', Gst.StreamError.FAILED)
+        self.bus.post(Gst.Message.new_error(source, error, 'fault injection'))
+
+    def get_state(self) -> dict:
+        """What a rebuilt pipeline needs to resume where this one stopped"""
+        return {
+            'playing': self.playing,
+            'recording': self.recording,
+            'output': {key: value for key, value in self.get_output_config().items()
+                       if key in ('framerate', 'scale', 'roi')},
+            'rtp_destinations': list(self.rtp_destinations)
+        }
+
+    def restore_state(self, state: dict, output: bool = True):
+        if output:
+            self.set_quality(state['output'])
+            for host, port in state['rtp_destinations']:
+                self.add_rtp_destination(host, port)
+        if state['recording']:
+            self.start_recording()
+        if state['playing']:
+            self.play()
+
+    def restart(self, state: dict):
+        """Reset the stopped pipeline and resume the state it had before failing, reusing its elements"""
+        self.pipeline.set_state(Gst.State.NULL)
+        if self.stall_probe is not None:
+            self.elements['source'].get_static_pad('src').remove_probe(self.stall_probe)
+            self.stall_probe = None
+        self.error = None
+        self.playing = False
+        self.recording = False
+        self.preroll()
+        # The elements kept their properties and RTP destinations
+        self.restore_state(state, output=False)
+
+    def start_recording(self):
+        if self.record_elements is None:
+            raise Exception('Recording is not enabled')
+        if self.recording:
+            return
+        self.logger.info('Recording started')
+        self.recording = True
+        self.record_elements['record_valve'].set_property('drop', False)
+        if not self.playing and not self.keep_playing:
+            self.elements['live_valve'].set_property('drop', True)
+            self.pipeline.set_state(Gst.State.PLAYING)
+        # Segments should start on a keyframe
+        self.request_keyframe()
+
+    def stop_recording(self):
+        if not self.recording:
+            return
+        self.logger.info('Recording stopped')
+        self.recording = False
+        self.record_elements['record_valve'].set_property('drop', True)
+        # Close the current segment at the next keyframe, rather than leaving it open until the next recording
+        self.record_elements['record_sink'].emit('split-now')
+        if not self.playing:
+            self.pause()
+
+    def get_recording_stats(self) -> dict | None:
+        if self.record_elements is None:
+            return None
+        segments = list_segments(self.recording_config['directory'])
+        return {
+            'recording': self.recording,
+            'segments': len(segments),
+            'bytes': sum(size for _, size in segments),
+            'queued_bytes': self.record_elements['record_queue'].get_property('current-level-bytes')
+        }
+
+    def fail(self, error: str):
+        """
+        Ends start() with the failure, on the loop. The pipeline is left to be stopped with stop() from a worker
+        thread, as the NULL state change may block until the streaming threads are done.
+        """
+        self.error = error
+        self.detach_bus()
+
     def stop(self):
         # Clean up
         self.pipeline.set_state(Gst.State.NULL)
         self.logger.info('Pipeline stopped')
-        self.loop.quit()
+        if self.event_loop is not None and not self.event_loop.is_closed():
+            self.event_loop.call_soon_threadsafe(self.detach_bus)
@@ -1 +1,3 @@
 from .server import WebSocketMessageHandler, WebSocketServer
+from .client_session import ClientSession
+from .compression import COMPRESSION_POLICIES
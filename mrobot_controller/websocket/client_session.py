@@ -0,0 +1,185 @@
+import asyncio
+import collections
+import logging
+import time
+from websockets.exceptions import ConnectionClosed
+from .compression import get_selective_deflate
+
+
+class SessionMetrics:
+    """Process wide websocket metrics, shared by all client sessions"""
+    def __init__(self, registry):
+        self.frames_sent = registry.counter('frames_sent_total', 'Video frames sent to clients')
+        self.frames_dropped = registry.counter('frames_dropped_total',
+                                               'Video frames dropped from the queue of a lagging client')
+        self.messages_sent = registry.counter('websocket_messages_sent_total', 'Control messages sent to clients')
+        self.bytes_sent = registry.counter('websocket_sent_bytes_total', 'Bytes sent to clients')
+        self.bytes_received = registry.counter('websocket_received_bytes_total', 'Bytes received from clients')
+
+
+class ClientSession:
+    """
+    Outgoing message queues of a single client.
+
+    Control messages (command responses, events) are queued in order and are always sent
+    before video frames. Video frames are kept in a small bounded queue, where a new frame
+    drops the oldest pending one, so a slow link never accumulates stale frames.
+    """
+    ROLE_CONTROLLER = 'controller'
+    ROLE_VIEWER = 'viewer'
+
+    def __init__(self, websocket, role: str = ROLE_CONTROLLER, max_pending_frames: int = 1,
+                 max_pending_messages: int = 64, latency_stats=None, metrics: SessionMetrics = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.websocket = websocket
+        self.role = role
+        self.latency_stats = latency_stats
+        self.metrics = metrics
+        # Wire format of the video events sent to this client, and the command protocol version it uses,
+        # negotiated by the message handler
+        self.video_transport = None
+        self.protocol_version = 1
+        self.control_queue = asyncio.Queue(max_pending_messages)
+        self.frame_queue = collections.deque(maxlen=max_pending_frames)
+        self.pending = asyncio.Event()
+        self.sender_task = None
+        # Only set with the 'control' compression policy, which leaves video frames uncompressed
+        self.deflate = get_selective_deflate(websocket)
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.send_time = 0.0
+        self.frame_delay = 0.0
+
+    @property
+    def is_controller(self) -> bool:
+        return self.role == self.ROLE_CONTROLLER
+
+    def start(self):
+        self.sender_task = asyncio.create_task(self.sender())
+
+    async def stop(self):
+        if self.sender_task is not None:
+            self.sender_task.cancel()
+            try:
+                await self.sender_task
+            except asyncio.CancelledError:
+                pass
+            self.sender_task = None
+        self.drop_pending_frames()
+
+    async def send(self, message):
+        if self.sender_task is None or self.sender_task.done():
+            return
+        await self.control_queue.put(message)
+        self.pending.set()
+
+    def send_nowait(self, message) -> bool:
+        """Queues a message without waiting for room in the queue. Returns False if it was full"""
+        if self.sender_task is None or self.sender_task.done():
+            return True
+        try:
+            self.control_queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        self.pending.set()
+        return True
+
+    def push_frame(self, message, on_done=None, timestamps: dict = None):
+        if len(self.frame_queue) == self.frame_queue.maxlen:
+            _, dropped_on_done, _ = self.frame_queue.popleft()
+            self.count_dropped_frame()
+            if dropped_on_done is not None:
+                dropped_on_done()
+        self.frame_queue.append((message, on_done, {**(timestamps or {}), 'enqueued': time.monotonic_ns()}))
+        self.pending.set()
+
+    def drop_pending_frames(self):
+        while self.frame_queue:
+            _, on_done, _ = self.frame_queue.popleft()
+            self.count_dropped_frame()
+            if on_done is not None:
+                on_done()
+
+    def count_dropped_frame(self):
+        self.frames_dropped += 1
+        if self.metrics is not None:
+            self.metrics.frames_dropped.inc()
+
+    async def sender(self):
+        try:
+            while True:
+                await self.pending.wait()
+                self.pending.clear()
+
+                while not self.control_queue.empty() or self.frame_queue:
+                    # Command responses and events always go first
+                    if self.deflate is not None:
+                        self.deflate.enabled = True
+                    while not self.control_queue.empty():
+                        message = self.control_queue.get_nowait()
+                        await self.websocket.send(self.unwrap(message))
+                        self.messages_sent += 1
+                        if self.metrics is not None:
+                            self.metrics.messages_sent.inc()
+                            self.metrics.bytes_sent.inc(self.message_size(message))
+
+                    if self.frame_queue:
+                        message, on_done, timestamps = self.frame_queue.popleft()
+                        if self.deflate is not None:
+                            self.deflate.enabled = False
+                        try:
+                            send_start = time.monotonic_ns()
+                            await self.websocket.send(self.unwrap(message))
+                            timestamps['sent'] = time.monotonic_ns()
+                            size = self.message_size(message)
+                            self.frames_sent += 1
+                            self.bytes_sent += size
+                            if self.metrics is not None:
+                                self.metrics.frames_sent.inc()
+                                self.metrics.bytes_sent.inc(size)
+                            self.send_time += (timestamps['sent'] - send_start) / 1e9
+                            # Exponential moving average of the time a frame waited and was being sent
+                            delay = (timestamps['sent'] - timestamps['enqueued']) / 1e9
+                            self.frame_delay += 0.2 * (delay - self.frame_delay)
+                            if self.latency_stats is not None:
+                                self.latency_stats.record(timestamps, ('encoded_to_enqueued', 'enqueued_to_sent',
+                                                                       'capture_to_sent'))
+                        finally:
+                            # The fragments may reference the frame's buffer, which on_done() may unmap
+                            message = None
+                            if on_done is not None:
+                                on_done()
+        except ConnectionClosed:
+            self.logger.debug('Connection closed while sending to %s', self.websocket.remote_address)
+            self.drop_pending_frames()
+
+    @staticmethod
+    def unwrap(message):
+        # A single fragment is sent as a plain message
+        if isinstance(message, list) and len(message) == 1:
+            return message[0]
+        return message
+
+    @staticmethod
+    def message_size(message) -> int:
+        if isinstance(message, list):
+            return sum(memoryview(fragment).nbytes for fragment in message)
+        return memoryview(message).nbytes
+
+    def get_stats(self) -> dict:
+        return {
+            'address': str(self.websocket.remote_address),
+            'role': self.role,
+            'video_transport': self.video_transport,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'messages_sent': self.messages_sent,
+            'bytes_sent': self.bytes_sent,
+            'send_time': self.send_time,
+            'frame_delay': self.frame_delay,
+            'pending_frames': len(self.frame_queue),
+            'pending_messages': self.control_queue.qsize()
+        }
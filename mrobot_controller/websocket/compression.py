@@ -0,0 +1,54 @@
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, Opcode
+
+# Compression policies: nothing is compressed, only control messages (command responses and events), or everything
+COMPRESSION_POLICIES = ('none', 'control', 'all')
+
+
+class SelectivePerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate which only compresses messages sent while `enabled` is set.
+    RFC 7692 flags compression per message, so clients decode both kinds of messages on the same connection.
+    Video frames are already compressed, and deflating them only costs CPU.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enabled = True
+        self.compressing = True
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        # Continuation frames follow the first frame of their message
+        if frame.opcode is not Opcode.CONT:
+            self.compressing = self.enabled
+        if not self.compressing:
+            return frame
+        return super().encode(frame)
+
+
+class SelectivePerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, SelectivePerMessageDeflate(extension.remote_no_context_takeover,
+                                                           extension.local_no_context_takeover,
+                                                           extension.remote_max_window_bits,
+                                                           extension.local_max_window_bits,
+                                                           self.compress_settings)
+
+
+def get_compression_extensions(policy: str) -> list | None:
+    """Server extensions of a compression policy, with the library's default settings"""
+    if policy not in COMPRESSION_POLICIES:
+        raise ValueError(f'Unsupported compression policy: {policy}')
+    if policy == 'none':
+        return None
+    factory = SelectivePerMessageDeflateFactory if policy == 'control' else ServerPerMessageDeflateFactory
+    return [factory(server_max_window_bits=12, client_max_window_bits=12, compress_settings={'memLevel': 5})]
+
+
+def get_selective_deflate(websocket) -> SelectivePerMessageDeflate | None:
+    """The connection's selective compression extension, if it was negotiated"""
+    protocol = getattr(websocket, 'protocol', websocket)
+    return next((extension for extension in getattr(protocol, 'extensions', [])
+                 if isinstance(extension, SelectivePerMessageDeflate)), None)
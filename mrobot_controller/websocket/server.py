@@ -1,16 +1,23 @@
 import websockets
 import logging
 import asyncio
+import socket
 from abc import ABC, abstractmethod
+from .client_session import ClientSession, SessionMetrics
+from .compression import get_compression_extensions
 
 
 class WebSocketMessageHandler(ABC):
     @abstractmethod
-    async def handle_message(self, message):
+    async def handle_message(self, message, session: ClientSession):
         pass
 
     @abstractmethod
-    async def on_client_disconnection(self):
+    async def on_client_connection(self, session: ClientSession):
+        pass
+
+    @abstractmethod
+    async def on_client_disconnection(self, session: ClientSession):
         pass
 
 
@@ -18,15 +25,30 @@ class CatMessageHandler(WebSocketMessageHandler):
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
 
-    async def handle_message(self, message):
-        self.logger.info(f"Handling message: {message}")
+    async def handle_message(self, message, session: ClientSession):
+        self.logger.info("Handling message (%d bytes)", len(message))
 
-    async def on_client_disconnection(self):
+    async def on_client_connection(self, session: ClientSession):
+        self.logger.info('Client connected')
+
+    async def on_client_disconnection(self, session: ClientSession):
         self.logger.info('Client disconnected')
 
 
 class WebSocketServer:
-    def __init__(self, message_handler: WebSocketMessageHandler, hosts=['localhost'], port=8765):
+    """
+    Websocket server with one controlling client, and optionally up to `max_viewers` read-only viewers.
+    Without viewers, a newly connected client replaces the current one.
+
+    `compression` is the permessage-deflate policy (see COMPRESSION_POLICIES), `max_message_size` and `max_queue`
+    limit incoming messages, and `write_limit` is the high-water mark of each connection's write buffer, in bytes.
+    Socket buffer sizes of 0 keep the system defaults.
+    """
+    def __init__(self, message_handler: WebSocketMessageHandler, hosts=['localhost'], port=8765,
+                 max_pending_frames: int = 1, max_viewers: int = 0, latency_stats=None, metrics=None,
+                 compression: str = 'control', max_message_size: int = 65536, max_queue: int = 16,
+                 write_limit: int = 32768, tcp_nodelay: bool = True, send_buffer_size: int = 0,
+                 receive_buffer_size: int = 0):
         if not isinstance(message_handler, WebSocketMessageHandler):
             raise TypeError("handler must be an instance of MessageHandler")
 
@@ -35,44 +57,160 @@ class WebSocketServer:
 
         self.host = hosts
         self.port = port
-        self.client = None
+        self.max_pending_frames = max_pending_frames
+        self.max_viewers = max_viewers
+        self.latency_stats = latency_stats
+        self.extensions = get_compression_extensions(compression)
+        self.max_message_size = max_message_size
+        self.max_queue = max_queue
+        self.write_limit = write_limit
+        self.tcp_nodelay = tcp_nodelay
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+        self.sessions = {}
+        self.metrics = None
+        if metrics is not None:
+            self.metrics = SessionMetrics(metrics)
+            metrics.gauge('websocket_clients', 'Connected clients', function=lambda: len(self.sessions))
+            metrics.gauge('send_queue_frames', 'Video frames waiting to be sent, over all clients',
+                          function=lambda: sum(len(s.frame_queue) for s in list(self.sessions.values())))
+            metrics.gauge('send_queue_messages', 'Control messages waiting to be sent, over all clients',
+                          function=lambda: sum(s.control_queue.qsize() for s in list(self.sessions.values())))
         self.message_handler = message_handler
-
-    async def register(self, websocket):
-        if self.client is not None:
-            await self.client.close(reason="Overriden. Only one client allowed.")
-            self.logger.warning(f"Closed connection to {websocket.remote_address} due to new client connecting")
-
-        self.client = websocket
-        self.logger.info(f"Client connected: {websocket.remote_address}")
+        self.server = None
+
+    @property
+    def controller_session(self) -> ClientSession | None:
+        return next((session for session in self.sessions.values() if session.is_controller), None)
+
+    def configure_socket(self, websocket):
+        sock = websocket.transport.get_extra_info('socket')
+        if sock is None:
+            return
+        try:
+            # asyncio already disables Nagle's algorithm on TCP connections; this only makes it explicit
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
+            if self.send_buffer_size > 0:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+            if self.receive_buffer_size > 0:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+        except OSError as e:
+            self.logger.warning(f"Failed to set socket options of {websocket.remote_address}: {e}")
+
+    async def register(self, websocket) -> ClientSession | None:
+        controller_session = self.controller_session
+        if controller_session is None:
+            role = ClientSession.ROLE_CONTROLLER
+        elif self.max_viewers == 0:
+            # Unregistered like any disconnection, so the handler stops the motors and cleans up after it
+            await self.unregister(controller_session.websocket)
+            await controller_session.websocket.close(reason="Overriden. Only one client allowed.")
+            self.logger.warning(f"Closed connection to {controller_session.websocket.remote_address} "
+                                f"due to new client connecting")
+            role = ClientSession.ROLE_CONTROLLER
+        elif len(self.sessions) - 1 < self.max_viewers:
+            role = ClientSession.ROLE_VIEWER
+        else:
+            self.logger.warning(f"Rejected {websocket.remote_address}: too many viewers")
+            await websocket.close(reason="Too many viewers")
+            return None
+
+        self.configure_socket(websocket)
+        session = ClientSession(websocket, role, self.max_pending_frames, latency_stats=self.latency_stats,
+                                metrics=self.metrics)
+        session.start()
+        self.sessions[websocket] = session
+        self.logger.info(f"Client connected: {websocket.remote_address} ({role})")
+        return session
 
     async def unregister(self, websocket):
-        if self.client == websocket:
-            self.logger.info(f"Client disconnected: {websocket.remote_address}")
-            self.client = None
-            await self.message_handler.on_client_disconnection()
-
-    async def send(self, message):
-        if self.client is not None:
-            await self.client.send(message)
-            self.logger.debug(f"Sent message to client: {message}")
-        else:
+        session = self.sessions.pop(websocket, None)
+        if session is None:
+            return
+
+        self.logger.info(f"Client disconnected: {websocket.remote_address}")
+        await session.stop()
+        if session.is_controller and self.sessions:
+            # Hand control over to the longest connected viewer
+            successor = next(iter(self.sessions.values()))
+            successor.role = ClientSession.ROLE_CONTROLLER
+            self.logger.info(f"Client {successor.websocket.remote_address} is now the controller")
+        await self.message_handler.on_client_disconnection(session)
+
+    def send(self, message):
+        """
+        Queue a message, or a list of fragments making up a single message, to all clients, ahead of any video frame.
+        Never waits: a client whose queue is full has stopped reading, and misses the message rather than holding
+        it back from the others.
+        """
+        if not self.sessions:
             self.logger.warning("No client connected to send the message to")
-
-    async def serve(self, websocket, path):
-        await self.register(websocket)
-        if self.client is websocket:
-            try:
-                async for message in websocket:
-                    self.logger.debug(f"Received message: {message}")
-                    response = await self.message_handler.handle_message(message)
-                    await websocket.send(response)
-            except websockets.exceptions.ConnectionClosed as e:
-                self.logger.error(f"Connection closed: {websocket.remote_address} - {e}")
-            finally:
-                await self.unregister(websocket)
+        for session in list(self.sessions.values()):
+            if session.send_nowait(message):
+                self.logger.debug("Queued message to client (%d bytes)", ClientSession.message_size(message))
+            else:
+                self.logger.warning("Dropped message to %s: its queue is full", session.websocket.remote_address)
+
+    def send_frame(self, messages: dict, frame=None):
+        """
+        Queue a video frame to all clients, dropping the oldest pending frame of a lagging client.
+        `messages` maps each video transport to the frame's message in that transport, so a frame is serialized once
+        no matter how many clients receive it. `frame`, if given, is acquired for every client it's queued to, and
+        released once sent or dropped, and its timestamps are used for latency statistics.
+        Must be called from the event loop thread.
+        """
+        for session in self.sessions.values():
+            message = messages.get(session.video_transport)
+            if message is None:
+                continue
+            if frame is not None:
+                session.push_frame(message, frame.acquire().release, frame.timestamps)
+            else:
+                session.push_frame(message)
+
+    def get_video_transports(self) -> set:
+        return {session.video_transport for session in list(self.sessions.values())}
+
+    def get_stats(self) -> dict:
+        return {'clients': [session.get_stats() for session in list(self.sessions.values())]}
+
+    def get_controller_stats(self) -> dict:
+        controller_session = self.controller_session
+        return controller_session.get_stats() if controller_session is not None else {}
+
+    async def serve(self, websocket, path=None):
+        session = await self.register(websocket)
+        if session is None:
+            return
+
+        try:
+            # Inside the try, so a client dropping during the greeting is still unregistered
+            await self.message_handler.on_client_connection(session)
+            async for message in websocket:
+                self.logger.debug("Received message (%d bytes)", len(message))
+                if self.metrics is not None:
+                    self.metrics.bytes_received.inc(len(message))
+                response = await self.message_handler.handle_message(message, session)
+                if response is not None:
+                    await session.send(response)
+        except websockets.exceptions.ConnectionClosed as e:
+            self.logger.error(f"Connection closed: {websocket.remote_address} - {e}")
+        finally:
+            await self.unregister(websocket)
+
+    async def listen(self):
+        """Start accepting connections, without waiting for the server to close"""
+        if self.server is None:
+            self.server = await websockets.serve(self.serve, self.host, self.port, logger=self.logger,
+                                                 compression=None, extensions=self.extensions,
+                                                 max_size=self.max_message_size, max_queue=self.max_queue,
+                                                 write_limit=self.write_limit)
+            self.logger.info(f"Server started on ws://{self.host}:{self.port}")
 
     async def start(self):
-        server = await websockets.serve(self.serve, self.host, self.port, logger=self.logger)
-        self.logger.info(f"Server started on ws://{self.host}:{self.port}")
-        await server.wait_closed()
+        await self.listen()
+        await self.server.wait_closed()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
@@ -15,6 +15,7 @@ setup(
     entry_points={
         'console_scripts': [
             'mrobot-controller=mrobot_controller.app:main',
+            'mrobot-controller-bench=mrobot_controller.bench:main',
         ],
     },
 )
@@ -0,0 +1,92 @@
+"""Compare encoding time and frame size of the video frame codecs"""
+import argparse
+import io
+import time
+from PIL import Image
+
+
+def synthetic_frame(width: int, height: int) -> Image.Image:
+    # Smooth areas, fine detail and sensor-like noise, roughly resembling camera content
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    detail = Image.effect_mandelbrot((width, height), (-2.0, -1.25, 0.75, 1.25), 64)
+    return Image.merge('RGB', (gradient, detail, noise))
+
+
+def bench_pil(image: Image.Image, image_format: str, iterations: int, **params):
+    raw = image.tobytes()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        buffered = io.BytesIO()
+        Image.frombuffer('RGB', image.size, raw, 'raw', 'RGB', 0, 1).save(buffered, format=image_format, **params)
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations, buffered.getbuffer().nbytes
+
+
+def bench_raw(image: Image.Image, iterations: int):
+    raw = image.tobytes()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        payload = bytearray(raw)
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations, len(payload)
+
+
+def bench_gst_jpeg(image: Image.Image, iterations: int, quality: int):
+    try:
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+    except (ImportError, ValueError):
+        return None
+
+    Gst.init(None)
+    width, height = image.size
+    pipeline = Gst.parse_launch(f'appsrc name=src caps=video/x-raw,format=RGB,width={width},height={height},'
+                                f'framerate=30/1 ! videoconvert ! jpegenc quality={quality} ! '
+                                f'appsink name=sink sync=false')
+    src = pipeline.get_by_name('src')
+    sink = pipeline.get_by_name('sink')
+    pipeline.set_state(Gst.State.PLAYING)
+
+    raw = image.tobytes()
+    size = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        src.emit('push-buffer', Gst.Buffer.new_wrapped(raw))
+        sample = sink.emit('pull-sample')
+        size = sample.get_buffer().get_size()
+    elapsed = time.perf_counter() - start
+    pipeline.set_state(Gst.State.NULL)
+    return elapsed / iterations, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--jpeg-quality', type=int, default=85)
+    args = parser.parse_args()
+
+    image = synthetic_frame(args.width, args.height)
+    results = {
+        'PNG (PIL)': bench_pil(image, 'PNG', args.iterations),
+        f'JPEG q{args.jpeg_quality} (PIL)': bench_pil(image, 'JPEG', args.iterations, quality=args.jpeg_quality),
+        f'JPEG q{args.jpeg_quality} (GStreamer jpegenc)': bench_gst_jpeg(image, args.iterations, args.jpeg_quality),
+        'Raw RGB': bench_raw(image, args.iterations)
+    }
+
+    print(f'{args.width}x{args.height}, {args.iterations} frames\n')
+    print('| Codec | ms/frame | bytes/frame |')
+    print('|-------|----------|-------------|')
+    for codec, result in results.items():
+        if result is None:
+            print(f'| {codec} | n/a | n/a |')
+            continue
+        seconds, size = result
+        print(f'| {codec} | {seconds * 1000:.3f} | {size} |')
+
+
+if __name__ == '__main__':
+    main()
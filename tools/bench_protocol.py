@@ -0,0 +1,75 @@
+"""
+Compare handling of move commands with the messagepack and compact protocols, through the controller's own
+message handler: decoding, dispatching to the simulated motor backend and encoding the response
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mrobot_controller.app_config import AppConfig  # noqa: E402
+from mrobot_controller.controller import Controller  # noqa: E402
+from mrobot_controller.serdes import serialize, encode_compact, PROTOCOL_COMPACT, COMPACT_MOVE  # noqa: E402
+from mrobot_controller.websocket import ClientSession  # noqa: E402
+
+
+def create_controller() -> Controller:
+    config = AppConfig(None)
+    config.get_app_server_config()['metrics-port'] = 0
+    config.get_motors_config()['backend'] = 'simulated'
+    config.get_shared_memory_config()['enabled'] = False
+    return Controller(config)
+
+
+def create_session() -> ClientSession:
+    """The controlling client, with no connection, which negotiated the compact protocol"""
+    session = ClientSession(None, ClientSession.ROLE_CONTROLLER)
+    session.protocol_version = PROTOCOL_COMPACT
+    return session
+
+
+async def bench_message(controller: Controller, session: ClientSession, message: bytes, iterations: int) -> float:
+    commands = controller.motor_controller.commands
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await controller.handle_message(message, session)
+    rate = iterations / (time.perf_counter() - start)
+    # A failing command would only have measured the error path
+    if controller.motor_controller.commands - commands != iterations:
+        raise RuntimeError('Not every move command reached the motor controller')
+    return rate
+
+
+async def bench(iterations: int) -> dict:
+    controller = create_controller()
+    session = create_session()
+    messages = {
+        'messagepack (with response)': serialize({'command': 'move', 'parameters': {'left': 0.5, 'right': -0.25}}),
+        'compact (with response)': encode_compact(COMPACT_MOVE, 16383, -8192, ack=True),
+        'compact (fire-and-forget)': encode_compact(COMPACT_MOVE, 16383, -8192, ack=False)
+    }
+    results = {}
+    for protocol, message in messages.items():
+        results[protocol] = await bench_message(controller, session, message, iterations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(bench(args.iterations))
+    print('| Protocol | messages/sec (single core) |')
+    print('|----------|----------------------------|')
+    for protocol, rate in results.items():
+        print(f'| {protocol} | {rate:,.0f} |')
+
+
+if __name__ == '__main__':
+    main()
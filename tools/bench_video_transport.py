@@ -0,0 +1,61 @@
+"""
+Compare the size and cost of the video event transports: serializing the event, and sending it, which adds the
+websockets framing of the message (where the payload is copied into the frame)
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from websockets.protocol import Protocol, Side, State  # noqa: E402
+from mrobot_controller.serdes import serialize_video_event, VIDEO_TRANSPORTS  # noqa: E402
+
+
+def send(protocol: Protocol, fragments: list) -> int:
+    """Frames the message like a websocket send, and returns the bytes that would be written to the socket"""
+    if len(fragments) == 1:
+        protocol.send_binary(fragments[0])
+    else:
+        protocol.send_binary(fragments[0], fin=False)
+        for fragment in fragments[1:-1]:
+            protocol.send_continuation(fragment, fin=False)
+        protocol.send_continuation(fragments[-1], fin=True)
+    return sum(len(data) for data in protocol.data_to_send())
+
+
+def bench(transport: str, payload: bytes, iterations: int):
+    protocol = Protocol(Side.SERVER, state=State.OPEN)
+    start = time.perf_counter()
+    for sequence in range(iterations):
+        fragments = serialize_video_event(transport, 'video_frame', payload, sequence)
+    serialized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for sequence in range(iterations):
+        wire_size = send(protocol, serialize_video_event(transport, 'video_frame', payload, sequence))
+    sent = time.perf_counter() - start
+    return sum(len(fragment) for fragment in fragments), wire_size, serialized / iterations, sent / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20_000, 150_000, 600_000],
+                        help='Payload sizes in bytes')
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f'| Payload | Transport | Message bytes | Overhead | Serialize us/frame | Send us/frame | Send MB/s |')
+    print(f'|---------|-----------|---------------|----------|--------------------|---------------|-----------|')
+    for size in args.sizes:
+        payload = os.urandom(size)
+        for transport in VIDEO_TRANSPORTS:
+            message_size, wire_size, serialized, sent = bench(transport, payload, args.iterations)
+            overhead = 100 * (wire_size - size) / size
+            print(f'| {size // 1000} kB | {transport} | {message_size} | {overhead:.1f}% '
+                  f'| {serialized * 1e6:.0f} | {sent * 1e6:.0f} | {size / sent / 1e6:.0f} |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Compare the websocket transport settings: server CPU time per video frame and move command round-trip time,
+streaming incompressible frames (like PNG, JPEG or H.264) to a client offering permessage-deflate, like browsers do
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import websockets  # noqa: E402
+from mrobot_controller.metrics import RollingHistogram  # noqa: E402
+from mrobot_controller.serdes import serialize, deserialize  # noqa: E402
+from mrobot_controller.websocket import WebSocketServer, WebSocketMessageHandler, ClientSession  # noqa: E402
+
+FRAME_MAGIC = b'MV'
+# Server settings of each variant, over the configuration defaults
+VARIANTS = {
+    'library defaults': {'compression': 'all', 'max_message_size': 2 ** 20},
+    'defaults': {},
+    'compression none': {'compression': 'none'},
+    'compression all': {'compression': 'all'},
+    'nagle': {'tcp_nodelay': False},
+    'write limit 1 MiB': {'write_limit': 2 ** 20},
+    'send buffer 64 KiB': {'send_buffer_size': 65536}
+}
+
+
+class MoveHandler(WebSocketMessageHandler):
+    async def handle_message(self, message, session: ClientSession):
+        command, parameters = deserialize(message)
+        return serialize({'command': command, 'success': True, 'response': 'ok'})
+
+    async def on_client_connection(self, session: ClientSession):
+        session.video_transport = 'binary'
+
+    async def on_client_disconnection(self, session: ClientSession):
+        pass
+
+
+def run_client(port: int, duration: float, command_rate: float, results):
+    async def client():
+        rtt = RollingHistogram(100_000)
+        sent = []
+        frames = 0
+        move = serialize({'command': 'move', 'parameters': {'left': 0.5, 'right': 0.5}})
+        async with websockets.connect(f'ws://127.0.0.1:{port}', max_size=None) as websocket:
+            async def commander():
+                while True:
+                    sent.append(time.perf_counter())
+                    await websocket.send(move)
+                    await asyncio.sleep(1 / command_rate)
+
+            task = asyncio.create_task(commander())
+            deadline = time.monotonic() + duration
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), deadline - time.monotonic())
+                    except asyncio.TimeoutError:
+                        break
+                    if message[:2] == FRAME_MAGIC:
+                        frames += 1
+                    elif sent:
+                        rtt.record((time.perf_counter() - sent.pop(0)) * 1000)
+            finally:
+                task.cancel()
+        results.put({'frames_received': frames, 'command_rtt_ms': rtt.percentiles()})
+
+    asyncio.run(client())
+
+
+async def bench_variant(settings: dict, args) -> dict:
+    server = WebSocketServer(MoveHandler(), hosts=['127.0.0.1'], port=args.port, **settings)
+    await server.listen()
+    results = multiprocessing.Queue()
+    client = multiprocessing.Process(target=run_client, args=(args.port, args.duration, args.command_rate, results))
+    client.start()
+    while not server.sessions:
+        await asyncio.sleep(0.01)
+
+    payload = FRAME_MAGIC + os.urandom(args.frame_size - len(FRAME_MAGIC))
+    frames = 0
+    cpu_start = time.process_time()
+    start = time.monotonic()
+    while server.sessions and time.monotonic() - start < args.duration:
+        server.send_frame({'binary': payload})
+        frames += 1
+        await asyncio.sleep(max(0.0, start + frames / args.fps - time.monotonic()))
+    cpu = time.process_time() - cpu_start
+
+    client_results = await asyncio.to_thread(results.get)
+    await asyncio.to_thread(client.join)
+    server.stop()
+    await server.server.wait_closed()
+    return {'frames_sent': frames, 'cpu_ms_per_frame': cpu * 1000 / frames, **client_results}
+
+
+async def bench(args):
+    print(f'| Variant | Server CPU ms/frame | Frames received | Move RTT p50 | p95 | p99 (ms) |')
+    print(f'|---------|---------------------|-----------------|--------------|-----|----------|')
+    for name in args.variants:
+        result = await bench_variant(VARIANTS[name], args)
+        rtt = result['command_rtt_ms']
+        print(f'| {name} | {result["cpu_ms_per_frame"]:.3f} | {result["frames_received"]}/{result["frames_sent"]} '
+              f'| {rtt["p50"]:.2f} | {rtt["p95"]:.2f} | {rtt["p99"]:.2f} |')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--variants', nargs='+', choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument('--frame-size', type=int, default=100_000, help='Video frame size in bytes')
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per variant')
+    parser.add_argument('--command-rate', type=float, default=50, help='move commands per second')
+    parser.add_argument('--port', type=int, default=8898)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Check that bus messages reach the asyncio loop: an error posted from another thread, and a real end of stream"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mrobot_controller.video_streamer import VideoStreamer, VideoFrameHandler  # noqa: E402
+from gi.repository import Gst, GLib  # noqa: E402
+
+
+class CountingHandler(VideoFrameHandler):
+    def __init__(self):
+        self.frames = 0
+
+    def handle_frame(self, frame):
+        self.frames += 1
+
+
+def post_error(streamer: VideoStreamer, posted: list):
+    error = GLib.Error.new_literal(Gst.CoreError.quark(), 'injected error', Gst.CoreError.FAILED)
+    posted.append(time.monotonic())
+    streamer.bus.post(Gst.Message.new_error(streamer.pipeline, error, 'posted by bus_delivery_check'))
+
+
+async def check_error(mode: str, timeout: float) -> bool:
+    streamer = VideoStreamer(CountingHandler(), '', 640, 480, test=True, mode=mode)
+    streamer.preroll()
+    task = asyncio.create_task(streamer.start())
+    streamer.play()
+    await asyncio.sleep(0.5)
+    posted = []
+    # Posted from a thread other than the loop's, like GStreamer's streaming threads do
+    threading.Thread(target=post_error, args=(streamer, posted)).start()
+    try:
+        error = await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        print(f'{mode}: error message not delivered within {timeout}s')
+        streamer.stop()
+        return False
+    latency = (time.monotonic() - posted[0]) * 1000
+    print(f'{mode}: error delivered in {latency:.2f} ms: {error!r}')
+    return error == 'injected error'
+
+
+async def check_eos(mode: str, timeout: float) -> bool:
+    handler = CountingHandler()
+    streamer = VideoStreamer(handler, '', 640, 480, test=True, mode=mode)
+    streamer.preroll()
+    task = asyncio.create_task(streamer.start())
+    streamer.play()
+    await asyncio.sleep(0.5)
+    streamer.pipeline.send_event(Gst.Event.new_eos())
+    try:
+        error = await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        print(f'{mode}: end of stream not delivered within {timeout}s')
+        streamer.stop()
+        return False
+    print(f'{mode}: end of stream delivered after {handler.frames} frames: {error!r}')
+    return error == 'end of stream' and handler.frames > 0
+
+
+async def check_stop(mode: str, timeout: float) -> bool:
+    streamer = VideoStreamer(CountingHandler(), '', 640, 480, test=True, mode=mode)
+    streamer.preroll()
+    task = asyncio.create_task(streamer.start())
+    await asyncio.sleep(0.2)
+    streamer.stop()
+    try:
+        error = await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        print(f'{mode}: start() did not return after stop()')
+        return False
+    print(f'{mode}: stopped: {error!r}')
+    return error is None
+
+
+async def run(modes: list, timeout: float) -> bool:
+    results = []
+    for mode in modes:
+        for check in (check_error, check_eos, check_stop):
+            results.append(await check(mode, timeout))
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--modes', nargs='+', default=['png', 'jpeg', 'h264'])
+    parser.add_argument('--timeout', type=float, default=5)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args.modes, args.timeout))
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Inject faults into the test source of an in-process controller, and measure the time until frames flow again"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import msgpack  # noqa: E402
+import websockets  # noqa: E402
+from mrobot_controller.app_config import AppConfig  # noqa: E402
+from mrobot_controller.controller import Controller  # noqa: E402
+
+FRAME_MAGIC = b'MV'
+
+
+class RecoveryClient:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.frames = 0
+        self.events = asyncio.Queue()
+        self.responses = asyncio.Queue()
+
+    async def receiver(self):
+        async for message in self.websocket:
+            if message[:2] == FRAME_MAGIC:
+                self.frames += 1
+                continue
+            deserialized = msgpack.unpackb(message)
+            if 'event' in deserialized:
+                await self.events.put(deserialized)
+            else:
+                await self.responses.put(deserialized)
+
+    async def command(self, command: str, parameters: dict) -> dict:
+        await self.websocket.send(msgpack.packb({'command': command, 'parameters': parameters}))
+        return await asyncio.wait_for(self.responses.get(), 10)
+
+    async def wait_event(self, name: str, timeout: float) -> dict:
+        deadline = time.monotonic() + timeout
+        while True:
+            event = await asyncio.wait_for(self.events.get(), deadline - time.monotonic())
+            if event['event'] == name:
+                return event
+
+    async def wait_frames(self, timeout: float) -> bool:
+        frames = self.frames
+        deadline = time.monotonic() + timeout
+        while self.frames == frames:
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.005)
+        return True
+
+
+async def check_fault(client: RecoveryClient, fault: str, timeout: float) -> bool:
+    start = time.monotonic()
+    response = await client.command('video_fault', {'fault': fault})
+    if not response['success']:
+        print(f'{fault}: {response["response"]}')
+        return False
+    try:
+        if fault != 'record-error':
+            error = await client.wait_event('video_error', timeout)
+            await client.wait_event('ready', timeout)
+            print(f'{fault}: failed with {error["error"]!r}, ready after {time.monotonic() - start:.3f}s')
+        if not await client.wait_frames(timeout):
+            print(f'{fault}: no frame after recovery')
+            return False
+    except asyncio.TimeoutError:
+        print(f'{fault}: not recovered within {timeout}s')
+        return False
+    print(f'{fault}: frames again after {time.monotonic() - start:.3f}s')
+    return True
+
+
+async def run(args) -> bool:
+    config = AppConfig(None)
+    config.get_video_config().update(test=True, mode=args.mode, transport='binary')
+    config.get_app_server_config().update({'port': args.port, 'metrics-port': 0})
+    config.get_recording_config().update(enabled=True, directory=args.recording_directory)
+    config.get_supervisor_config()['stall-timeout'] = args.stall_timeout
+    controller = Controller(config)
+    controller_task = asyncio.create_task(controller.run())
+    try:
+        await asyncio.sleep(0.5)
+        async with websockets.connect(f'ws://127.0.0.1:{args.port}', max_size=None) as websocket:
+            client = RecoveryClient(websocket)
+            receiver = asyncio.create_task(client.receiver())
+            await client.command('video_transport', {'format': 'binary'})
+            if not controller.video_ready:
+                await client.wait_event('ready', 30)
+            await client.command('video_start', {})
+            await client.command('record_start', {})
+            results = [await check_fault(client, fault, args.timeout) for fault in args.faults]
+            stats = (await client.command('stats', {}))['response']
+            print(f'Supervisor: {stats["supervisor"]}, recording: {stats["recording"]}')
+            receiver.cancel()
+    finally:
+        controller.stop()
+        controller_task.cancel()
+        try:
+            await controller_task
+        except asyncio.CancelledError:
+            pass
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--faults', nargs='+', default=['error', 'eos', 'stall', 'record-error'])
+    parser.add_argument('--mode', default='jpeg', choices=['png', 'jpeg', 'h264'])
+    parser.add_argument('--stall-timeout', type=float, default=1.0)
+    parser.add_argument('--timeout', type=float, default=15)
+    parser.add_argument('--recording-directory', default='/tmp/mrobot-recovery-check')
+    parser.add_argument('--port', type=int, default=8897)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args))
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
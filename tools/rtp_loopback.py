@@ -0,0 +1,89 @@
+"""Loopback check of the RTP output: stream the test source to a local UDP receiver, and count the frames received"""
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mrobot_controller.video_streamer import VideoStreamer, VideoFrameHandler  # noqa: E402
+
+RTP_HEADER = struct.Struct('!BBHII')
+NAL_TYPE_SPS = 7
+NAL_TYPE_STAP_A = 24
+
+
+class DiscardingHandler(VideoFrameHandler):
+    def handle_frame(self, frame):
+        pass
+
+
+def receive(sock: socket.socket, duration: float) -> dict:
+    stats = {'packets': 0, 'frames': 0, 'bytes': 0, 'max_packet': 0, 'parameter_sets': 0, 'payload_types': set()}
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            packet = sock.recv(65536)
+        except socket.timeout:
+            continue
+        first, second, _, _, _ = RTP_HEADER.unpack_from(packet)
+        if first >> 6 != 2:
+            continue
+        stats['packets'] += 1
+        stats['bytes'] += len(packet)
+        stats['max_packet'] = max(stats['max_packet'], len(packet))
+        stats['payload_types'].add(second & 0x7F)
+        # The marker bit is set on the last packet of each access unit
+        if second & 0x80:
+            stats['frames'] += 1
+        nal_type = packet[RTP_HEADER.size] & 0x1F
+        if nal_type in (NAL_TYPE_SPS, NAL_TYPE_STAP_A):
+            stats['parameter_sets'] += 1
+    stats['payload_types'] = sorted(stats['payload_types'])
+    return stats
+
+
+async def stream(sock: socket.socket, args) -> dict:
+    rtp = {'port': args.port, 'mtu': args.mtu, 'max-destinations': 1}
+    streamer = VideoStreamer(DiscardingHandler(), '', 640, 480, test=True, mode='h264', rtp=rtp)
+    bus_task = asyncio.create_task(streamer.start())
+    streamer.add_rtp_destination('127.0.0.1', args.port)
+    streamer.play()
+    try:
+        return await asyncio.to_thread(receive, sock, args.duration)
+    finally:
+        streamer.stop()
+        await bus_task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=7788)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--mtu', type=int, default=1200)
+    parser.add_argument('--min-fps', type=float, default=10, help='Fail below this received frame rate')
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', args.port))
+    sock.settimeout(0.2)
+
+    try:
+        stats = asyncio.run(stream(sock, args))
+    finally:
+        sock.close()
+
+    fps = stats['frames'] / args.duration
+    print(f'Received {stats["packets"]} packets, {stats["frames"]} frames ({fps:.1f} fps), '
+          f'{stats["bytes"]} bytes, largest packet {stats["max_packet"]} bytes, '
+          f'{stats["parameter_sets"]} parameter set packets, payload types {stats["payload_types"]}')
+    ok = fps >= args.min_fps and stats['max_packet'] <= args.mtu and stats['parameter_sets'] > 0
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()